@@ -0,0 +1,211 @@
+"""
+This module provides benchmarks for the knowledge graph build and import steps.
+"""
+
+import os
+import shutil
+import time
+from pathlib import Path
+
+import pandas as pd
+from dotenv import load_dotenv
+
+
+def benchmark_compression(work_dir, data_dir=None, run_import=False, modes=(None, "gzip")):
+    """
+    Compare the wall time and bytes read of plain and gzip compressed KG files.
+
+    For each mode, the node and relationship files of the KG are rebuilt in `work_dir` with
+    save_dataframe_to_kg(compression=mode), keeping the header layout of each file, and
+    read back with pandas. If `run_import` is True, the rebuilt files are also staged in
+    the Neo4j import directory and imported with neo4j-admin.
+
+    Parameters
+    ----------
+    work_dir (str): Scratch directory for the rebuilt KG files. It is removed after each mode.
+    data_dir (str): KG directory with "nodes" and "relationships" subdirectories.
+        Defaults to the NEO4J_DATA environment variable.
+    run_import (bool): If True, also time staging and the bulk import. This overwrites the
+        database NEO4J_DATABASE, so only use it on a test instance.
+    modes (tuple): Compression modes to compare, None (plain CSV) or "gzip".
+
+    Returns
+    -------
+    pandas.DataFrame: One row per mode with the number of files, bytes on disk, and timings in seconds.
+    "total_time" is the time of the build plus, with `run_import`, staging and the import.
+
+    Example
+    -------
+    >>> benchmark_compression("../benchmark", run_import=True)
+    """
+    load_dotenv("../.env", override=True)
+    data_dir = data_dir or os.getenv("NEO4J_DATA")
+    input_files = [
+        (sub_dir, file)
+        for sub_dir in ("nodes", "relationships")
+        for file in sorted(list(Path(data_dir, sub_dir).glob("*.csv")) + list(Path(data_dir, sub_dir).glob("*.csv.gz")))
+    ]
+
+    results = []
+    for mode in modes:
+        label = mode or "plain"
+        mode_dir = os.path.join(work_dir, label)
+        for sub_dir in ("nodes", "relationships"):
+            os.makedirs(os.path.join(mode_dir, sub_dir), exist_ok=True)
+
+        # Build the KG files with the given compression
+        build_time = 0.0
+        n_rows = 0
+        for sub_dir, file in input_files:
+            elapsed, rows = _build_file(file, os.path.join(mode_dir, sub_dir), mode)
+            build_time += elapsed
+            n_rows += rows
+
+        output_files = [
+            file
+            for sub_dir in ("nodes", "relationships")
+            for file in Path(mode_dir, sub_dir).iterdir()
+            if file.name.endswith((".csv", ".csv.gz"))
+        ]
+        n_bytes = sum(os.path.getsize(file) for file in output_files)
+
+        # Read the files back as the next build step would
+        start_time = time.perf_counter()
+        for file in output_files:
+            _read_file(file)
+        read_time = time.perf_counter() - start_time
+
+        result = {
+            "mode": label,
+            "files": len(output_files),
+            "rows": n_rows,
+            "bytes": n_bytes,
+            "build_time": round(build_time, 2),
+            "read_time": round(read_time, 2),
+        }
+
+        total_time = build_time
+        if run_import:
+            timings = _time_import(mode_dir, mode)
+            total_time += timings["stage_time"] + timings["import_time"]
+            result.update(timings)
+        result["total_time"] = round(total_time, 2)
+
+        shutil.rmtree(mode_dir, ignore_errors=True)
+        print(result, flush=True)
+        results.append(result)
+
+    return pd.DataFrame(results)
+
+
+def _read_file(file):
+    # Read a KG file, using the separate header file if the file has no header line
+    header_file = f"{file}.header"
+    if os.path.exists(header_file):
+        names = pd.read_csv(header_file, nrows=0).columns
+        return pd.read_csv(file, dtype=str, keep_default_na=False, header=None, names=names)
+    return pd.read_csv(file, dtype=str, keep_default_na=False)
+
+
+def _build_file(input_file, output_dir, compression):
+    # Rebuild a KG file with save_dataframe_to_kg. Returns the build time and the number of rows.
+    import genelab_utils
+
+    df = _read_file(input_file)
+    name = input_file.name.removesuffix(".gz").removesuffix(".csv").rsplit("_", 1)[0]
+    split_header = os.path.exists(f"{input_file}.header")
+
+    start_time = time.perf_counter()
+    genelab_utils.save_dataframe_to_kg(df, name, output_dir, split_header=split_header, compression=compression or "")
+    return time.perf_counter() - start_time, len(df)
+
+
+def _time_import(data_dir, compression):
+    import neo4j_bulk_importer as importer
+
+    # Stage the rebuilt files as they are: compressed files stay compressed, plain files stay plain
+    start_time = time.perf_counter()
+    importer.setup(compression=compression or "", data_dir=data_dir)
+    stage_time = time.perf_counter() - start_time
+
+    # Bytes read by neo4j-admin: the staged data files
+    import_dir = os.path.join(os.getenv("NEO4J_HOME"), "import")
+    import_bytes = sum(
+        os.path.getsize(file)
+        for pattern in ("*_n.csv*", "*_r.csv*")
+        for file in Path(import_dir).glob(pattern)
+        if not file.name.startswith(("header_", "Meta"))
+    )
+
+    importer.prepare_bulk_import(data_dir=data_dir)
+    start_time = time.perf_counter()
+    importer.run_bulk_import()
+    import_time = time.perf_counter() - start_time
+
+    return {"import_bytes": import_bytes, "stage_time": round(stage_time, 2), "import_time": round(import_time, 2)}
+
+
+def benchmark_append(study_ids, batch_sizes=(1_000, 10_000), max_workers=(1, 4), run_import=True, edition="enterprise"):
+    """
+    Compare the throughput of the append-mode loader with a full import.
+
+    The database must contain the full KG, including the studies in `study_ids`. If `run_import` is True,
+    the KG is imported first with import_from_csv_to_neo4j_<edition> and the import is timed. For each
+    combination of batch size and number of workers, the studies are then removed from the database
+    and loaded again with append_studies().
+
+    Parameters
+    ----------
+    study_ids (list): Accessions of the studies that are appended, e.g. ["OSD-679"].
+    batch_sizes (tuple): Numbers of rows per transaction to compare.
+    max_workers (tuple): Numbers of concurrent transactions to compare.
+    run_import (bool): If True, import the full KG first. This overwrites the database
+        NEO4J_DATABASE, so only use it on a test instance.
+    edition (str): Neo4j edition used for the full import: "community", "desktop", or "enterprise".
+
+    Returns
+    -------
+    pandas.DataFrame: One row for the full import and one row per append configuration with the
+    number of rows, the total time in seconds (including the row selection for the appends), and the rows per second.
+
+    Example
+    -------
+    >>> benchmark_append(["OSD-679"], batch_sizes=(1000, 5000, 20000), max_workers=(1, 4, 8))
+    """
+    import neo4j_append_loader as loader
+    import neo4j_bulk_importer as importer
+
+    load_dotenv("../.env", override=True)
+
+    results = []
+    if run_import:
+        n_rows = loader.count_kg_rows(os.getenv("NEO4J_DATA"))
+
+        start_time = time.perf_counter()
+        getattr(importer, f"import_from_csv_to_neo4j_{edition}")()
+        import_time = time.perf_counter() - start_time
+
+        result = {"mode": "full import", "batch_size": None, "max_workers": None, "rows": n_rows,
+                  "time": round(import_time, 2), "load_time": round(import_time, 2),
+                  "rows_per_s": round(n_rows / import_time)}
+        print(result, flush=True)
+        results.append(result)
+
+    for batch_size in batch_sizes:
+        for workers in max_workers:
+            # Restore the database without the studies
+            loader.remove_studies(study_ids, batch_size=batch_size)
+
+            start_time = time.perf_counter()
+            summary = loader.append_studies(study_ids, batch_size=batch_size, max_workers=workers)
+            append_time = time.perf_counter() - start_time
+
+            n_rows = int(summary["rows"].sum())
+            load_time = float(summary["time"].sum())
+            result = {"mode": "append", "batch_size": batch_size, "max_workers": workers, "rows": n_rows,
+                      "time": round(append_time, 2), "load_time": round(load_time, 2),
+                      "rows_per_s": round(n_rows / max(load_time, 1e-9))}
+            print(result, flush=True)
+            results.append(result)
+
+    return pd.DataFrame(results)
@@ -1,22 +1,36 @@
 import os
 import shutil
 import glob
+import gzip
 
-from io import StringIO
+from io import BytesIO, StringIO
 import json
 import hashlib
 from urllib.parse import quote
 import re
+import threading
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from dateutil.parser import parse
+import numpy as np
 import pandas as pd
 import requests
 from dotenv import load_dotenv
 
+import http_utils
+
 API_ROOT = "https://visualization.osdr.nasa.gov/biodata/api/v2/"
 DATASET_URL = f"{API_ROOT}dataset/"
 DATASET_PATH = "../data"  # data download directory
+# cached OSDR API responses, outside of DATASET_PATH so that a reset of the downloads keeps them
+HTTP_CACHE_PATH = os.getenv("OSDR_CACHE_PATH", "../cache/osdr")
+DATASET_INDEX_FILE = "dataset_index.json"  # column header index, stored next to the manifest
+
+_response_cache = None
+_dataset_indexes = {}
+_dataset_index_lock = threading.Lock()
 
 
 def setup_environment():
@@ -80,6 +94,38 @@ def validate_kg_metadata():
     print("Metadata files passed the check!")
 
 
+def configure_http_cache(ttl=None, max_size_mb=None, offline=None):
+    """
+    Configure the on-disk cache for OSDR API responses.
+
+    Parameters that are not specified are read from the environment variables
+    OSDR_CACHE_TTL (seconds, default: 1 day), OSDR_CACHE_MAX_MB (default: 1024),
+    and OSDR_OFFLINE (true/false, default: false). In offline mode only cached
+    responses are used. The cache is stored in OSDR_CACHE_PATH (default: "../cache/osdr").
+    """
+    global _response_cache
+
+    if ttl is None:
+        ttl = float(os.getenv("OSDR_CACHE_TTL", 24 * 3600))
+    if max_size_mb is None:
+        max_size_mb = float(os.getenv("OSDR_CACHE_MAX_MB", 1024))
+    if offline is None:
+        offline = os.getenv("OSDR_OFFLINE", "false").lower() == "true"
+
+    if _response_cache is not None:
+        _response_cache.flush()
+    _response_cache = http_utils.ResponseCache(
+        HTTP_CACHE_PATH, ttl=ttl, max_size=int(max_size_mb * 1e6), offline=offline
+    )
+    return _response_cache
+
+
+def get_response_cache():
+    if _response_cache is None:
+        configure_http_cache()
+    return _response_cache
+
+
 def get_processed_datasets():
     metadata = get_info()
     metadata = filter_by_gl_processed(metadata)
@@ -109,7 +155,8 @@ def get_info():
         # "&" "format.header.multi" # you'd use this to break up the header into two lines for the "legacy" format
         # "&" "format.header.mark" # you'd use this to prepend "#" to header lines for the "legacy" format
     )
-    metadata = pd.read_csv(quote(url, safe=":/=?&"), na_filter=False)
+    content = get_response_cache().get(quote(url, safe=":/=?&"), timeout=60)
+    metadata = pd.read_csv(BytesIO(content), na_filter=False)
 
     # Simplify column names
     metadata.rename(
@@ -185,15 +232,99 @@ def filter_by_organism(metadata, taxids):
     return metadata
 
 
-def download_data_files(assays, file_types, filters, reset=False):
+def download_data_files(
+    assays,
+    file_types,
+    filters,
+    reset=False,
+    max_workers=1,
+    rate_limit=10,
+    chunksize=None,
+    file_format="csv",
+):
+    """
+    Download the processed data files for the given assays and reduce their size with a filter function.
+
+    Parameters
+    ----------
+    assays (pandas.DataFrame): One row per assay with "identifier" and "technology" columns.
+    file_types (dict): Maps a technology to the file type (substring of the file name) to download.
+    filters (dict): Maps a file type to a filter function applied to the downloaded data.
+    reset (bool): If True, remove all previously downloaded files.
+    max_workers (int): Number of studies downloaded concurrently.
+    rate_limit (float): Maximum number of HTTP requests per second across all workers.
+    chunksize (int): If set, stream each data file and parse and filter it in chunks of
+        this many rows, so that peak memory doesn't depend on the size of the file.
+    file_format (str): Storage format of the filtered data files: "csv", "csv.gz" (gzip
+        compressed CSV), or "parquet". Parquet files preserve the column types and can be
+        read column by column.
+
+    Returns
+    -------
+    pandas.DataFrame: A manifest with one row per downloaded file (assay columns + "filename" and "url").
+    """
     if reset:
         shutil.rmtree(DATASET_PATH)
+        _dataset_indexes.pop(DATASET_PATH, None)
 
     os.makedirs(DATASET_PATH, exist_ok=True)
 
-    file_list = []
+    session = http_utils.create_session(pool_size=max_workers)
+    limiter = http_utils.RateLimiter(rate_limit)
+
+    # Process all assays of a study in the same task, so that files shared
+    # by several assays are only downloaded once.
+    studies = list(assays.groupby("identifier", sort=False).indices.values())
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(
+            executor.map(
+                lambda positions: download_study_files(
+                    assays,
+                    positions,
+                    file_types,
+                    filters,
+                    session,
+                    limiter,
+                    chunksize=chunksize,
+                    file_format=file_format,
+                ),
+                studies,
+            )
+        )
+    elapsed = time.perf_counter() - start_time
+
+    # Restore the original order of the assays
+    file_infos = {}
+    n_files = 0
+    n_bytes = 0
+    for study_infos, study_files, study_bytes in results:
+        file_infos.update(study_infos)
+        n_files += study_files
+        n_bytes += study_bytes
+
+    file_list = [info for position in range(len(assays)) for info in file_infos.get(position, [])]
+
+    print(
+        f"Downloaded {n_files} files ({n_bytes / 1e6:.1f} MB) in {elapsed:.1f} s: "
+        f"{n_files / max(elapsed, 1e-9):.2f} files/s, {n_bytes / 1e6 / max(elapsed, 1e-9):.2f} MB/s"
+    )
 
-    for _, row in assays.iterrows():
+    return pd.DataFrame(file_list)
+
+
+def download_study_files(
+    assays, positions, file_types, filters, session, limiter, chunksize=None, file_format="csv"
+):
+    # Downloads the files for the assays at the given positions. Returns the file info
+    # rows keyed by position, the number of files downloaded, and the number of bytes downloaded.
+    file_infos = {}
+    n_files = 0
+    n_bytes = 0
+
+    for position in positions:
+        row = assays.iloc[position]
         identifier = row["identifier"]
         technology = row["technology"]
 
@@ -203,17 +334,27 @@ def download_data_files(assays, file_types, filters, reset=False):
         if file_type:
             url = os.path.join(DATASET_URL, identifier, "files")
             try:
-                response = requests.get(url, allow_redirects=True, timeout=10)
-                response.raise_for_status()
+                content = get_response_cache().get(url, session=session, limiter=limiter)
 
                 # Get filename and URL for each dataset and download it
-                datafile_info = get_file_info(response.json(), file_type)
+                datafile_info = get_file_info(json.loads(content), file_type)
                 for info in datafile_info:
                     filename = info["filename"]
                     file_url = info["url"]
 
-                    success = download_data_file(file_url, filename, filter_func, DATASET_PATH)
-                    time.sleep(0.1)
+                    success, size = _download_data_file(
+                        file_url,
+                        filename,
+                        filter_func,
+                        DATASET_PATH,
+                        session,
+                        limiter,
+                        chunksize=chunksize,
+                        file_format=file_format,
+                    )
+                    if size > 0:
+                        n_files += 1
+                        n_bytes += size
                     if not success:
                         continue
 
@@ -221,12 +362,34 @@ def download_data_files(assays, file_types, filters, reset=False):
                     file_info = row.copy()
                     file_info["filename"] = filename
                     file_info["url"] = file_url
-                    file_list.append(file_info)
+                    file_infos.setdefault(position, []).append(file_info)
 
             except requests.exceptions.RequestException as e:
                 print(f"Error fetching {url}: {str(e)}")
 
-    return pd.DataFrame(file_list)
+    return file_infos, n_files, n_bytes
+
+
+def save_manifest(manifest, manifest_path):
+    """
+    Save the manifest as a CSV file. The file is only rewritten if its content changed,
+    so that KG files built from the manifest (see is_kg_file_current) stay current.
+
+    Returns
+    -------
+    bool: True if the file was written.
+    """
+    content = manifest.to_csv(index=False)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, newline="") as f:
+            if f.read() == content:
+                print(f"Manifest unchanged: {manifest_path}")
+                return False
+
+    with open(f"{manifest_path}.part", "w", newline="") as f:
+        f.write(content)
+    os.replace(f"{manifest_path}.part", manifest_path)
+    return True
 
 
 def get_file_info(data, file_type):
@@ -249,46 +412,570 @@ def get_file_info(data, file_type):
     return rows
 
 
-def download_data_file(url, filename, filter_func, dataset_path):
-    file_path = os.path.join(dataset_path, filename)
-
-    if not os.path.exists(file_path):
+def download_data_file(
+    url,
+    filename,
+    filter_func,
+    dataset_path,
+    session=None,
+    limiter=None,
+    chunksize=None,
+    file_format="csv",
+):
+    success, _ = _download_data_file(
+        url,
+        filename,
+        filter_func,
+        dataset_path,
+        session,
+        limiter,
+        chunksize=chunksize,
+        file_format=file_format,
+    )
+    return success
+
+
+def _download_data_file(
+    url,
+    filename,
+    filter_func,
+    dataset_path,
+    session=None,
+    limiter=None,
+    chunksize=None,
+    file_format="csv",
+):
+    # Returns a success flag and the number of bytes downloaded
+    file_path = os.path.join(dataset_path, stored_filename(filename, file_format))
+    # Write to a temporary file first, so an interrupted download doesn't leave a partial file behind.
+    temp_path = f"{file_path}.part"
+    size = 0
+
+    if find_dataset_file(dataset_path, filename) is None:
         try:
-            response = requests.get(url, allow_redirects=True, timeout=10)
-            response.raise_for_status()
+            if limiter is not None:
+                limiter.acquire()
 
-            print(f"Downloading: {filename}")
+            if chunksize:
+                header, size = _stream_data_file(
+                    url, filename, filter_func, temp_path, session, chunksize, file_format
+                )
+                empty = header is None
+            else:
+                response = (session or requests).get(url, allow_redirects=True, timeout=10)
+                response.raise_for_status()
+                size = len(response.content)
+
+                print(f"Downloading: {filename}")
+
+                # Load CSV content into DataFrame
+                data = pd.read_csv(StringIO(response.text), low_memory=False)
 
-            # Load CSV content into DataFrame
-            data = pd.read_csv(StringIO(response.text), low_memory=False)
+                # Reduce the size of the data file by applying a filter function
+                filtered_data = data
+                if filter_func is not None:
+                    filtered_data = filter_func(data)
 
-            # Reduce the size of the data file by applying a filter function
-            if filter_func is not None:
-                filtered_data = filter_func(data)
+                empty = filtered_data.empty
+                header = None if empty else merge_dataset_header(None, filtered_data)
+                if not empty:
+                    if file_format == "parquet":
+                        filtered_data.to_parquet(temp_path, index=False)
+                    elif file_format == "csv.gz":
+                        filtered_data.to_csv(temp_path, index=False, compression="gzip")
+                    else:
+                        filtered_data.to_csv(temp_path, index=False)
 
-            if filtered_data.empty:
+            if empty:
                 print(f"Skipping file: {filename}. No data after filtering.")
-                return False
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return False, size
 
-            # Save the filtered DataFrame
-            filtered_data.to_csv(file_path, index=False)
+            # Save the filtered data
+            os.replace(temp_path, file_path)
+            record_dataset_header(dataset_path, filename, header)
 
         except requests.exceptions.RequestException as e:
             print(f"Failed to download {filename}: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        except (OSError, ValueError, TypeError) as e:
+            # Parsing or writing failed, e.g. values that can't be stored in the file format
+            print(f"Failed to save {filename}: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False, size
     else:
         print(f"File already exist: {filename}")
 
-    return True
+    return True, size
+
+
+def _stream_data_file(url, filename, filter_func, output_path, session, chunksize, file_format="csv"):
+    # Parses the response body in chunks, filters each chunk, and appends the
+    # remaining rows to the output file. Returns the header (columns, dtypes,
+    # and number of rows) of the written data, or None if no rows were written,
+    # and the number of bytes downloaded.
+    header = None
+    with (session or requests).get(url, allow_redirects=True, timeout=10, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+
+        print(f"Downloading: {filename}")
+
+        if file_format == "parquet":
+            writer = ParquetChunkWriter(output_path, chunksize)
+        elif file_format == "csv.gz":
+            writer = gzip.open(output_path, "wt", newline="")
+        else:
+            writer = open(output_path, "w", newline="")
+
+        with writer:
+            # Read the values as text and parse them per column, so the Parquet writer
+            # can keep the original text of the values
+            for text in pd.read_csv(response.raw, chunksize=chunksize, dtype=str):
+                if file_format == "parquet":
+                    chunk = writer.parse(text)
+                else:
+                    chunk, _ = parse_chunk(text)
+                if filter_func is not None:
+                    chunk = filter_func(chunk)
+                if chunk.empty:
+                    continue
+
+                if file_format == "parquet":
+                    writer.write(chunk)
+                else:
+                    # Write the header with the first non-empty chunk only
+                    chunk.to_csv(writer, index=False, header=header is None)
+                    header = merge_dataset_header(header, chunk)
+
+        size = response.raw.tell()
+
+    if file_format == "parquet":
+        header = writer.header
+    return header, size
+
+
+class ParquetChunkWriter:
+    """
+    Writes the filtered chunks of a CSV file to a Parquet file.
+
+    The type of a column depends on all of its values, which aren't known until the last
+    chunk has been parsed. The rows are therefore appended as text to a temporary CSV file,
+    keeping the original text of the values that weren't changed by the filter, and the
+    type of each column is inferred from all chunks, including the rows that were filtered
+    out, the same way as pandas.read_csv() infers it from the whole file: integer columns
+    are only widened to float if a later chunk has fractional or missing values, and
+    columns with any text keep the original text of all values. When the writer is closed,
+    the temporary file is converted with these types, so the Parquet file is the same as
+    the one written by DataFrame.to_parquet() without chunks.
+    """
+
+    def __init__(self, path, chunksize=100_000):
+        self.path = path
+        self.text_path = f"{path}.csv"
+        self.chunksize = chunksize
+        self.text_file = None
+        self.columns = None
+        self.source_kinds = {}  # kinds of the columns of the CSV file
+        self.filter_kinds = {}  # kinds of the columns changed by the filter
+        self.source_columns = set()  # columns that kept the original text in any chunk
+        self.header = None
+        self.text = None
+        self.parsed = None
+
+    def parse(self, text):
+        # Parse a chunk of text and record the kinds of its columns
+        self.parsed, kinds = parse_chunk(text)
+        self.text = text
+        for col, kind in kinds.items():
+            self.source_kinds[col] = _merge_kinds(self.source_kinds.get(col), kind)
+        return self.parsed
+
+    def write(self, df):
+        # Append a filtered chunk of the last parsed chunk
+        if self.columns is None:
+            self.columns = [str(col) for col in df.columns]
+            self.text_file = open(self.text_path, "w", newline="")
+
+        # Keep the original text of values that the filter didn't change
+        rows_kept = self.text is not None and df.index.isin(self.text.index).all()
+        values = {}
+        for col in df.columns:
+            if rows_kept and col in self.text.columns and df[col].equals(self.parsed[col].loc[df.index]):
+                values[col] = self.text[col].loc[df.index].reset_index(drop=True)
+                self.source_columns.add(col)
+            else:
+                values[col] = df[col].reset_index(drop=True)
+                self.filter_kinds[col] = _merge_kinds(self.filter_kinds.get(col), _dtype_kind(df[col]))
+        pd.DataFrame(values).to_csv(self.text_file, index=False, header=self.text_file.tell() == 0)
+
+    def dtypes(self):
+        # dtypes of the columns in the Parquet file
+        dtypes = {}
+        for col in self.columns:
+            kind = self.filter_kinds.get(col)
+            if col in self.source_columns:
+                kind = _merge_kinds(self.source_kinds[col], kind)
+            dtypes[col] = _kind_dtype(kind)
+        return dtypes
+
+    def _convert(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        dtypes = self.dtypes()
+        writer = None
+        try:
+            chunks = pd.read_csv(
+                self.text_path, dtype=dtypes, keep_default_na=False, na_values=[""], chunksize=self.chunksize
+            )
+            for chunk in chunks:
+                # Booleans with missing values are objects, as in pandas.read_csv()
+                for col in [col for col, dtype in dtypes.items() if dtype == "boolean"]:
+                    chunk[col] = chunk[col].astype(object).where(chunk[col].notna(), np.nan)
+                if writer is None:
+                    # Derive the schema like DataFrame.to_parquet(). Columns without values in
+                    # the first chunk are booleans or strings.
+                    schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                    for i, field in enumerate(schema):
+                        if field.type == pa.null():
+                            value_type = pa.bool_() if dtypes[field.name] == "boolean" else pa.string()
+                            schema = schema.set(i, field.with_type(value_type))
+                    writer = pq.ParquetWriter(self.path, schema)
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                self.header = merge_dataset_header(self.header, chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        try:
+            if self.text_file is not None:
+                self.text_file.close()
+                if exc_type is None:
+                    self._convert()
+        finally:
+            if os.path.exists(self.text_path):
+                os.remove(self.text_path)
+
+
+# Values parsed as booleans by pandas.read_csv()
+BOOLEAN_VALUES = {"True": True, "TRUE": True, "true": True, "False": False, "FALSE": False, "false": False}
+
+
+def parse_chunk(text):
+    """
+    Parse a chunk of a CSV file that was read as text, like pandas.read_csv() would.
+
+    Returns the parsed chunk and the kind of each column: a tuple of the type of the
+    values (None if all values are missing, "bool", "int", "float", or "str") and
+    whether any value is missing. Integer columns with missing values are parsed as
+    nullable integers, so they aren't converted to float in some chunks only.
+    """
+    columns = {}
+    kinds = {}
+    for col in text.columns:
+        columns[col], kinds[col] = _parse_column(text[col])
+    return pd.DataFrame(columns, index=text.index), kinds
+
+
+def _parse_column(values):
+    present = values.dropna()
+    missing = len(present) < len(values)
+    if present.empty:
+        return values.astype(float), (None, missing)
+
+    if present.isin(BOOLEAN_VALUES.keys()).all():
+        parsed = values.map(BOOLEAN_VALUES)
+        return (parsed.astype(object) if missing else parsed.astype(bool)), ("bool", missing)
+
+    try:
+        numbers = pd.to_numeric(present)
+    except (ValueError, TypeError):
+        return values, ("str", missing)
+    if pd.api.types.is_integer_dtype(numbers):
+        if missing:
+            return pd.to_numeric(values).astype("Int64"), ("int", True)
+        return numbers, ("int", False)
+    return pd.to_numeric(values), ("float", missing)
+
+
+def _dtype_kind(values):
+    # Kind of a column that was changed by a filter function
+    missing = bool(values.isna().any())
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return "bool", missing
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return "int", missing
+    if pd.api.types.is_float_dtype(values.dtype):
+        return ("float" if values.notna().any() else None), missing
+    return "str", missing
+
+
+def _merge_kinds(kind, other):
+    # Kind of a column with the values of two chunks
+    if kind is None or other is None:
+        return kind or other
+    (base, missing), (other_base, other_missing) = kind, other
+    if base is None or other_base is None or base == other_base:
+        base = base or other_base
+    elif {base, other_base} == {"int", "float"}:
+        base = "float"
+    else:
+        base = "str"
+    return base, missing or other_missing
+
+
+def _kind_dtype(kind):
+    # dtype of a column in the whole file, as inferred by pandas.read_csv()
+    base, missing = kind
+    if base == "int" and not missing:
+        return "int64"
+    if base == "bool":
+        return "boolean" if missing else "bool"
+    if base == "str":
+        return str
+    return "float64"
+
+
+def stored_filename(filename, file_format="csv"):
+    # Name of the local copy of a data file in the given storage format
+    if file_format == "parquet":
+        return f"{os.path.splitext(filename)[0]}.parquet"
+    if file_format == "csv.gz":
+        return f"{filename}.gz"
+    return filename
+
 
+def get_dataset_files(manifest):
+    # Paths of the downloaded data files in the manifest, e.g. to use as inputs of a KG file
+    file_paths = [find_dataset_file(DATASET_PATH, f) for f in manifest["filename"].unique()]
+    return [file_path for file_path in file_paths if file_path is not None]
+
+
+def find_dataset_file(dataset_path, filename):
+    """
+    Return the path of the local copy of a data file listed in the manifest, or None
+    if it hasn't been downloaded. Parquet copies take precedence over CSV copies.
+    """
+    for file_format in ["parquet", "csv.gz", "csv"]:
+        file_path = os.path.join(dataset_path, stored_filename(filename, file_format))
+        if os.path.exists(file_path):
+            return file_path
+    return None
+
+
+def get_dataset_columns(dataset_path, filename):
+    # Look up the column names of a data file in the header index
+    return get_dataset_header(dataset_path, filename)["columns"]
+
+
+def get_dataset_header(dataset_path, filename):
+    """
+    Return the header index entry of a data file listed in the manifest.
+
+    The entry contains the stored file name, columns, dtypes, number of rows, and size of the file.
+    Entries are kept in "dataset_index.json" in the data directory and are only
+    rebuilt when the size or modification time of the file changed. For CSV files that
+    weren't indexed when they were downloaded, only the header line is read: dtypes and
+    the number of rows are None (see build_dataset_index to count the rows).
+    """
+    file_path = find_dataset_file(dataset_path, filename)
+    if file_path is None:
+        raise FileNotFoundError(f"Data file not found: {filename}")
+
+    stat = os.stat(file_path)
+    index = _get_dataset_index(dataset_path)
+    with _dataset_index_lock:
+        entry = index.get(filename)
+
+    if (
+        entry is not None
+        and entry["file"] == os.path.basename(file_path)
+        and entry["size"] == stat.st_size
+        and entry["mtime"] == stat.st_mtime_ns
+    ):
+        return entry
+
+    return record_dataset_header(dataset_path, filename, scan_dataset_file(file_path))
+
+
+def build_dataset_index(manifest, max_workers=4, count_rows=False):
+    """
+    Build or update the header index for all downloaded data files in the manifest.
+    Only files that are new or changed since the last build are scanned.
+
+    With `count_rows` = True, the number of rows is also filled in for entries that
+    don't have it yet by counting the lines of the file (quoted values that contain
+    line breaks are counted as several rows).
+    """
+    filenames = [
+        filename
+        for filename in manifest["filename"].unique()
+        if find_dataset_file(DATASET_PATH, filename) is not None
+    ]
+
+    def index_file(filename):
+        entry = get_dataset_header(DATASET_PATH, filename)
+        if count_rows and entry.get("rows") is None:
+            file_path = os.path.join(DATASET_PATH, entry["file"])
+            header = {key: entry[key] for key in ["columns", "dtypes"]}
+            entry = record_dataset_header(
+                DATASET_PATH, filename, {**header, "rows": count_data_rows(file_path)}
+            )
+        return entry
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        entries = list(executor.map(index_file, filenames))
+
+    return pd.DataFrame(
+        [{"filename": f, **entry} for f, entry in zip(filenames, entries)],
+        columns=["filename", "file", "columns", "dtypes", "rows", "size", "mtime"],
+    )
+
+
+def scan_dataset_file(file_path):
+    # Get the columns of a data file, and the dtypes and number of rows of Parquet files
+    if file_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(file_path)
+        schema = parquet_file.schema_arrow
+        return {
+            "columns": schema.names,
+            "dtypes": {field.name: str(field.type) for field in schema},
+            "rows": parquet_file.metadata.num_rows,
+        }
+
+    # Only read the header line of CSV files
+    columns = pd.read_csv(file_path, nrows=0).columns
+    return {"columns": [str(col) for col in columns], "dtypes": None, "rows": None}
+
+
+def count_data_rows(file_path):
+    # Count the data rows of a CSV file by counting its lines, without parsing them
+    opener = gzip.open if file_path.endswith(".gz") else open
+    n_lines = 0
+    last = b"\n"
+    with opener(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            n_lines += block.count(b"\n")
+            last = block[-1:]
+    if last != b"\n":
+        n_lines += 1  # last line without a line break
+    return max(n_lines - 1, 0)
+
+
+def merge_dataset_header(header, df):
+    # Add a chunk of data to a header index entry. Columns with
+    # different dtypes in different chunks are recorded as "object".
+    dtypes = {str(col): str(dtype) for col, dtype in df.dtypes.items()}
+    if header is None:
+        return {"columns": list(dtypes), "dtypes": dtypes, "rows": len(df)}
+
+    for col, dtype in dtypes.items():
+        if header["dtypes"].get(col) != dtype:
+            header["dtypes"][col] = "object"
+    header["rows"] += len(df)
+    return header
+
+
+def record_dataset_header(dataset_path, filename, header):
+    # Store the header of a data file in the header index
+    file_path = find_dataset_file(dataset_path, filename)
+    stat = os.stat(file_path)
+    entry = {
+        "file": os.path.basename(file_path),
+        **header,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+    }
+
+    index = _get_dataset_index(dataset_path)
+    with _dataset_index_lock:
+        index[filename] = entry
+        os.makedirs(dataset_path, exist_ok=True)
+        index_path = os.path.join(dataset_path, DATASET_INDEX_FILE)
+        with open(f"{index_path}.part", "w") as f:
+            json.dump(index, f)
+        os.replace(f"{index_path}.part", index_path)
+
+    return entry
+
+
+def _get_dataset_index(dataset_path):
+    with _dataset_index_lock:
+        if dataset_path not in _dataset_indexes:
+            index_path = os.path.join(dataset_path, DATASET_INDEX_FILE)
+            index = {}
+            if os.path.exists(index_path):
+                with open(index_path) as f:
+                    index = json.load(f)
+            _dataset_indexes[dataset_path] = index
+        return _dataset_indexes[dataset_path]
+
+
+def read_dataset_file(dataset_path, filename, columns=None, as_string=False):
+    """
+    Read a data file listed in the manifest from the CSV or Parquet store.
+
+    Parameters
+    ----------
+    dataset_path (str): Data download directory.
+    filename (str): Name of the data file in the manifest.
+    columns (list): Columns to read. By default all columns are read.
+    as_string (bool): If True, read all values as strings and missing values as "".
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    file_path = find_dataset_file(dataset_path, filename)
+    if file_path.endswith(".parquet"):
+        df = pd.read_parquet(file_path, columns=columns)
+        if as_string:
+            df = df.fillna("").astype(str)
+        return df
+
+    if as_string:
+        return pd.read_csv(file_path, usecols=columns, dtype=str, keep_default_na=False)
+    return pd.read_csv(file_path, usecols=columns, low_memory=False)
+
+
+def get_metadata(manifest, max_workers=8, rate_limit=10):
+    """
+    Get the study and mission metadata for each row in the manifest.
+
+    Each study is only fetched once, even if it appears in multiple rows of the manifest.
+    The studies are fetched concurrently by `max_workers` threads that share a limit of
+    `rate_limit` requests per second.
+
+    Returns
+    -------
+    pandas.DataFrame: One row per manifest row and mission, in the order of the manifest.
+    """
+    keys = list(zip(manifest["identifier"], manifest["taxonomy"], manifest["organism"]))
+    unique_keys = list(dict.fromkeys(keys))
+
+    session = http_utils.create_session(pool_size=max_workers)
+    limiter = http_utils.RateLimiter(rate_limit)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            lambda key: extract_metadata(*key, session=session, limiter=limiter),
+            unique_keys,
+        )
+        metadata = dict(zip(unique_keys, results))
 
-def get_metadata(manifest):
     study_list = []
-    for _, row in manifest.iterrows():
-        identifier = row["identifier"]
-        taxonomy = row["taxonomy"]
-        organism = row["organism"]
-        study_list.extend(extract_metadata(identifier, taxonomy, organism))
-        time.sleep(0.1)
+    for key in keys:
+        study_list.extend(metadata[key])
 
     return pd.DataFrame(study_list)
 
@@ -319,7 +1006,7 @@ def to_list(x):
     return [x]
 
 
-def extract_metadata(accession, taxonomy, organism):
+def extract_metadata(accession, taxonomy, organism, session=None, limiter=None):
     """
     Fetches the JSON for the given OSDR dataset accession (e.g. "OSD-47")
     and extracts:
@@ -334,9 +1021,7 @@ def extract_metadata(accession, taxonomy, organism):
     Returns a dict with those keys (values will be None if the field is missing).
     """
     url = f"https://visualization.osdr.nasa.gov/biodata/api/v2/dataset/{accession}/?format=json"
-    response = requests.get(url, timeout=60)
-    response.raise_for_status()
-    data = response.json()
+    data = json.loads(get_response_cache().get(url, session=session, timeout=60, limiter=limiter))
 
     # Top-level object for this accession
     ds = data.get(accession, {})
@@ -383,34 +1068,72 @@ def extract_metadata(accession, taxonomy, organism):
     return study_list
 
 
-def extract_gene_info(manifest):
-    gene_list = []
-    for _, row in manifest.iterrows():
-        file_path = os.path.join(DATASET_PATH, row["filename"])
-        if os.path.exists(file_path):
-            df = pd.read_csv(
-                file_path,
-                usecols=["ENTREZID", "GENENAME"],
-                dtype=str,
-                keep_default_na=False,
-            )
-            df["organism"] = row["organism"]
-            df["taxonomy"] = str(row["taxonomy"])
-            gene_list.append(df)
+def extract_gene_info(manifest, max_workers=1):
+    """
+    Create a list of unique genes (ENTREZID) from all data files in the manifest.
+
+    The files are read by `max_workers` threads and merged into a running set of
+    unique genes, so memory scales with the number of unique genes rather than
+    the total number of rows. If a gene occurs in multiple files, the first file
+    in the manifest determines its name and organism.
 
-    mgenes = pd.concat(gene_list, ignore_index=True)
-    mgenes.drop_duplicates(subset="ENTREZID", inplace=True)
+    Returns
+    -------
+    pandas.DataFrame: Genes with the columns "identifier", "name", "organism", and "taxonomy".
+    """
+    # Each data file only needs to be read once per organism
+    files = manifest[["filename", "organism", "taxonomy"]].drop_duplicates()
+    files = [
+        (filename, organism, str(taxonomy))
+        for filename, organism, taxonomy in files.itertuples(index=False)
+        if find_dataset_file(DATASET_PATH, filename) is not None
+    ]
+
+    def read_genes(filename):
+        df = read_dataset_file(
+            DATASET_PATH, filename, columns=["ENTREZID", "GENENAME"], as_string=True
+        )
+        return df.drop_duplicates(subset="ENTREZID")
+
+    seen = set()
+    gene_list = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Keep at most a few files in flight and merge them in manifest order
+        pending = deque()
+        for file_info in files:
+            pending.append((file_info, executor.submit(read_genes, file_info[0])))
+            if len(pending) > 2 * max_workers:
+                _merge_genes(*pending.popleft(), seen, gene_list)
+        while pending:
+            _merge_genes(*pending.popleft(), seen, gene_list)
+
+    columns = ["ENTREZID", "GENENAME", "organism", "taxonomy"]
+    if gene_list:
+        mgenes = pd.concat(gene_list, ignore_index=True)
+    else:
+        mgenes = pd.DataFrame(columns=columns)
 
     # Match names of properties in metagraph
-    mgenes = mgenes[["ENTREZID", "GENENAME", "organism", "taxonomy"]]
+    mgenes = mgenes[columns]
     mgenes.rename(columns={"ENTREZID": "identifier", "GENENAME": "name"}, inplace=True)
 
     # Remove version number
-    mgenes["identifier"] = mgenes.identifier.apply(lambda x: x.split(".")[0])
+    mgenes["identifier"] = mgenes["identifier"].str.replace(r"\..*", "", regex=True)
 
     return mgenes
 
 
+def _merge_genes(file_info, future, seen, gene_list):
+    # Add the genes of a file that haven't been seen in previous files
+    _, organism, taxonomy = file_info
+    df = future.result()
+    df = df[~df["ENTREZID"].isin(seen)].copy()
+    seen.update(df["ENTREZID"])
+    df["organism"] = organism
+    df["taxonomy"] = taxonomy
+    gene_list.append(df)
+
+
 def extract_assay_info(manifest, variables):
     manifest["factors"] = manifest.apply(
         get_factor_data,
@@ -425,9 +1148,7 @@ def extract_assay_info(manifest, variables):
 
 
 def get_factor_data(row, dataset_path, variables):
-    file_path = os.path.join(dataset_path, row["filename"])
-    data = pd.read_csv(file_path, low_memory=False, nrows=1)
-    cols = data.columns
+    cols = get_dataset_columns(dataset_path, row["filename"])
     end_points = variables.get(row["measurement"], "")
     if end_points == "":
         print(
@@ -464,38 +1185,51 @@ def extract_materials(assays):
 
 
 def assign_material_to_assays(assays, mapped_materials):
-    material_dict = {
-        row["material"]: (row["material"], row["material_name"], row["material_id"])
-        for _, row in mapped_materials.iterrows()
-    }
-    assays[
-        [
-            "material_1",
-            "material_2",
-            "material_name_1",
-            "material_name_2",
-            "material_id_1",
-            "material_id_2",
-        ]
-    ] = assays.apply(assign_material, material_dict=material_dict, axis=1)
+    # Assign material to each factor. If a factor doesn't contain a material,
+    # use the default material specified for the assay
+    lookup = mapped_materials.drop_duplicates(subset="material", keep="last").set_index("material")
+    default = assays["material"].to_numpy()
+    positions = np.arange(len(assays))
+
+    columns = {}
+    for side in ["1", "2"]:
+        # The first factor of each assay that maps to a material
+        factors = pd.Series(assays[f"factors_{side}"].to_numpy(), index=positions).explode()
+        factors = factors[factors.isin(lookup.index)]
+        first = factors[~factors.index.duplicated()].reindex(positions)
+
+        material = first.where(first.notna(), default)
+        columns[f"material_{side}"] = material.to_numpy()
+        columns[f"material_name_{side}"] = (
+            lookup["material_name"].reindex(material).fillna("").to_numpy()
+        )
+        columns[f"material_id_{side}"] = lookup["material_id"].reindex(material).fillna("").to_numpy()
+
+    for col in [
+        "material_1",
+        "material_2",
+        "material_name_1",
+        "material_name_2",
+        "material_id_1",
+        "material_id_2",
+    ]:
+        assays[col] = columns[col]
     return assays
 
 
-def assign_material(row, material_dict):
-    # Assign material to each factor. If a factor doesn't contain a material,
-    # use the default material specified for the assay
-    default = material_dict.get(row["material"], (row["material"], "", ""))
-    mat1 = next((m for f in row["factors_1"] if (m := material_dict.get(f))), default)
-    mat2 = next((m for f in row["factors_2"] if (m := material_dict.get(f))), default)
-    return pd.Series([mat1[0], mat2[0], mat1[1], mat2[1], mat1[2], mat2[2]])
+def add_assay_identifiers(assays, fast=False):
+    """
+    Add a unique identifier "<study_id>-<assay_hash>" to each assay, where assay_hash
+    is the MD5 hash of the JSON representation of the assay.
 
+    With `fast` = True, the JSON representations are built one column at a time instead
+    of one record at a time. The hashes are identical (see verify_assay_identifiers).
+    """
+    if fast:
+        hashes = fast_assay_hashes(assays)
+    else:
+        hashes = assay_hashes(assays)
 
-def add_assay_identifiers(assays):
-    # pre‑compute each row’s MD5 hash of its JSON representation
-    hashes = [
-        hashlib.md5(json.dumps(r, sort_keys=True).encode()).hexdigest()
-        for r in assays.to_dict("records")
-    ]
     return assays.assign(
         study_id=assays["identifier"],
         assay_hash=hashes,
@@ -503,64 +1237,175 @@ def add_assay_identifiers(assays):
     )
 
 
-def extract_transcription_data(assays: pd.DataFrame, threshold: float) -> pd.DataFrame:
+def assay_hashes(assays):
+    # pre‑compute each row’s MD5 hash of its JSON representation
+    return [
+        hashlib.md5(json.dumps(r, sort_keys=True).encode()).hexdigest()
+        for r in assays.to_dict("records")
+    ]
+
+
+def fast_assay_hashes(assays):
+    # Build the same JSON strings as json.dumps(record, sort_keys=True) column by column.
+    # Each distinct value of a column is only serialized once.
+    parts = []
+    for col in sorted(assays.columns):
+        key = json.dumps(col)
+        encoded = {}
+        column_parts = []
+        for value in assays[col].tolist():
+            try:
+                part = encoded[(type(value), value)]
+            except KeyError:
+                part = encoded[(type(value), value)] = f"{key}: {json.dumps(value)}"
+            except TypeError:
+                # unhashable values, e.g., lists
+                part = f"{key}: {json.dumps(value)}"
+            column_parts.append(part)
+        parts.append(column_parts)
+
+    records = ["{" + ", ".join(row) + "}" for row in zip(*parts)]
+    if not parts:
+        records = ["{}"] * len(assays)
+    hashes = [hashlib.md5(record.encode()).hexdigest() for record in records]
+
+    # Distinct assays must get distinct identifiers
+    if len(set(hashes)) != len(set(records)):
+        raise ValueError("Hash collision: different assays were assigned the same assay_hash")
+
+    return hashes
+
+
+def verify_assay_identifiers(assays):
+    """
+    Check that the fast assay hashes are identical to the MD5 hashes of the JSON records,
+    so that identifiers created in either mode join with existing graphs.
+
+    Returns
+    -------
+    bool: True if all hashes match.
+    """
+    expected = assay_hashes(assays)
+    actual = fast_assay_hashes(assays)
+    mismatches = sum(e != a for e, a in zip(expected, actual))
+    if mismatches > 0:
+        print(f"ERROR: {mismatches} of {len(expected)} assay hashes don't match")
+        return False
+
+    print(f"All {len(expected)} assay hashes match")
+    return True
+
+
+def extract_transcription_data(
+    assays: pd.DataFrame, threshold: float, max_workers: int = 1
+) -> pd.DataFrame:
     """
     For each transcription‑profiling assay in `assays`, read its file once,
     extract ENTREZID/log2fc/adj_p.value columns, filter by threshold, and
     return a DataFrame of edges with columns ['from', 'to', 'log2fc', 'adj_p_value'].
+
+    All contrasts of a file are reshaped and filtered in a single vectorized pass.
+    With `max_workers` > 1 the files are processed in parallel worker processes.
     """
-    rows = []
     cols = ["from", "to", "log2fc", "adj_p_value"]
 
     # Filter to transcription profiling and group by filename
     tp = assays[assays["measurement"] == "transcription profiling"]
-    for filename, grp in tp.groupby("filename"):
-        # Print study_id when loading a new file
-        print(f"processing: {grp['study_id'].iat[0]}")
-        df = pd.read_csv(os.path.join(DATASET_PATH, filename), low_memory=False)
-
-        for _, row in grp.iterrows():
-            f = row["factors"]
-            log2fc_col = f"Log2fc_{f}"
-            adj_col = f"Adj.p.value_{f}"
-
-            # Skip if expected columns are missing
-            if not {log2fc_col, adj_col}.issubset(df.columns):
-                continue
-
-            # Select columns
-            sub = df[["ENTREZID", log2fc_col, adj_col]].dropna()
 
-            # Filter by p‑value threshold
-            sub = sub[sub[adj_col] <= threshold]
-            if sub.empty:
-                print(f"No statistically significant data for {row.study_id}: {log2fc_col}")
-                continue
-
-            # Rename to Neo4j convention
-            sub = sub.rename(
-                columns={"ENTREZID": "to", log2fc_col: "log2fc", adj_col: "adj_p_value"}
-            )
-            sub["from"] = row["identifier"]  # direct assignment of "from"
-            sub["to"] = sub["to"].astype(int)
+    # Look up the columns of each file here rather than in the worker processes,
+    # so that only this process updates the header index
+    tasks = [
+        (
+            DATASET_PATH,
+            filename,
+            get_dataset_columns(DATASET_PATH, filename),
+            grp["study_id"].tolist(),
+            grp["factors"].tolist(),
+            grp["identifier"].tolist(),
+            threshold,
+        )
+        for filename, grp in tp.groupby("filename")
+    ]
 
-            # Keep only the four columns in order
-            sub = sub[cols]
-            rows.append(sub)
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_extract_transcription_file, *zip(*tasks)))
+    else:
+        results = [_extract_transcription_file(*task) for task in tasks]
 
     # Concatenate or return empty
+    rows = [result for result in results if result is not None]
     if rows:
         return pd.concat(rows, ignore_index=True)
     return pd.DataFrame(columns=cols)
 
 
-def extract_methylation_data(assays: pd.DataFrame, threshold: float = 0.05) -> pd.DataFrame:
+def _extract_transcription_file(
+    dataset_path, filename, columns, study_ids, factors, identifiers, threshold
+):
+    # Extracts the edges for all assays of one file. Runs in a worker process.
+
+    # Print study_id when loading a new file
+    print(f"processing: {study_ids[0]}")
+
+    # Skip assays if expected columns are missing
+    available = set(columns)
+    assays = [
+        (study_id, identifier, f"Log2fc_{f}", f"Adj.p.value_{f}")
+        for study_id, f, identifier in zip(study_ids, factors, identifiers)
+        if {f"Log2fc_{f}", f"Adj.p.value_{f}"}.issubset(available)
+    ]
+    if not assays:
+        return None
+
+    # Read only the columns required for the assays of this file
+    log2fc_cols = [log2fc_col for _, _, log2fc_col, _ in assays]
+    adj_cols = [adj_col for _, _, _, adj_col in assays]
+    usecols = list(dict.fromkeys(["ENTREZID"] + log2fc_cols + adj_cols))
+    df = read_dataset_file(dataset_path, filename, columns=usecols)
+
+    # Reshape all Log2fc/Adj.p.value column pairs from wide to long format:
+    # (gene, contrast) matrices, filtered with a single mask
+    log2fc = df[log2fc_cols].to_numpy(dtype=float)
+    adj_p_value = df[adj_cols].to_numpy(dtype=float)
+    mask = (
+        df["ENTREZID"].notna().to_numpy()[:, None]
+        & ~np.isnan(log2fc)
+        & ~np.isnan(adj_p_value)
+        & (adj_p_value <= threshold)
+    )
+
+    for (study_id, _, log2fc_col, _), count in zip(assays, mask.sum(axis=0)):
+        if count == 0:
+            print(f"No statistically significant data for {study_id}: {log2fc_col}")
+
+    # Order the edges by assay, then by row in the file
+    assay_idx, row_idx = np.nonzero(mask.T)
+    if len(row_idx) == 0:
+        return None
+
+    return pd.DataFrame(
+        {
+            "from": np.array([identifier for _, identifier, _, _ in assays], dtype=object)[assay_idx],
+            "to": df["ENTREZID"].iloc[row_idx].astype(int).to_numpy(),
+            "log2fc": log2fc[row_idx, assay_idx],
+            "adj_p_value": adj_p_value[row_idx, assay_idx],
+        }
+    )
+
+
+def extract_methylation_data(
+    assays: pd.DataFrame, threshold: float = 0.05, max_workers: int = 1
+) -> pd.DataFrame:
     """
     For each DNA‑methylation‑profiling assay in `assays`, read its file once,
     extract ENTREZID/methylation_diff/q_value and region columns, filter by
     q‑value threshold, and return a DataFrame with the combined results.
+
+    All contrasts of a file are filtered in a single pass, and the region columns
+    (boolean flags and methylation_id) are computed once per region rather than once
+    per contrast. With `max_workers` > 1 the files are processed in parallel worker processes.
     """
-    rows = []
     cols = [
         "ENTREZID",
         "methylation_diff",
@@ -578,104 +1423,390 @@ def extract_methylation_data(assays: pd.DataFrame, threshold: float = 0.05) -> p
 
     # Filter by DNA methylation profiling and group by file
     dm = assays[assays["measurement"] == "DNA methylation profiling"]
-    for filename, grp in dm.groupby("filename"):
-        # print study_id when loading each file
-        print(f"processing: {grp['study_id'].iat[0]}")
-        df = pd.read_csv(os.path.join(DATASET_PATH, filename), low_memory=False)
-
-        for _, row in grp.iterrows():
-            f = row["factors"]
-            diff_col = f"meth.diff_{f}"
-            qv_col = f"qvalue_{f}"
-
-            # skip if expected columns are missing
-            if not {diff_col, qv_col}.issubset(df.columns):
-                continue
-
-            # select & drop NA
-            sub = df[
-                [
-                    "ENTREZID",
-                    diff_col,
-                    qv_col,
-                    "chr",
-                    "start",
-                    "end",
-                    "dist.to.feature",
-                    "prom",
-                    "exon",
-                    "intron",
-                ]
-            ].dropna()
-
-            # filter by q‑value threshold
-            sub = sub[sub[qv_col] <= threshold]
-            if sub.empty:
-                print(f"No significant data for {row['study_id']}: {diff_col}")
-                continue
-
-            # rename to standard column names
-            sub = sub.rename(
-                columns={
-                    diff_col: "methylation_diff",
-                    qv_col: "q_value",
-                    "prom": "in_promoter",
-                    "exon": "in_exon",
-                    "intron": "in_intron",
-                }
-            )
 
-            # map 0/1 → 'false'/'true'
-            neo4j_bool = {1: "true", 0: "false"}
-            sub["in_promoter"] = sub["in_promoter"].map(neo4j_bool)
-            sub["in_exon"] = sub["in_exon"].map(neo4j_bool)
-            sub["in_intron"] = sub["in_intron"].map(neo4j_bool)
-
-            # add assay_id and methylation_id
-            sub["assay_id"] = row["identifier"]
-            sub["methylation_id"] = (
-                sub["chr"] + ":" + sub["start"].astype(str) + "-" + sub["end"].astype(str)
-            )
+    # look up the columns of each file here, so that only this process updates the header index
+    tasks = [
+        (
+            DATASET_PATH,
+            filename,
+            get_dataset_columns(DATASET_PATH, filename),
+            grp["study_id"].tolist(),
+            grp["factors"].tolist(),
+            grp["identifier"].tolist(),
+            threshold,
+        )
+        for filename, grp in dm.groupby("filename")
+    ]
 
-            # keep columns in the desired order
-            rows.append(sub[cols])
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_extract_methylation_file, *zip(*tasks)))
+    else:
+        results = [_extract_methylation_file(*task) for task in tasks]
 
     # concatenate or return empty frame with proper columns
+    rows = [result[cols] for result in results if result is not None]
     if rows:
         return pd.concat(rows, ignore_index=True)
     return pd.DataFrame(columns=cols)
 
 
-def list_to_string(df):
-    for col in df.columns:
-        if df[col].apply(lambda x: isinstance(x, list)).all():
-            df[col] = df[col].apply(lambda x: "|".join(map(str, x)))
+def _extract_methylation_file(
+    dataset_path, filename, columns, study_ids, factors, identifiers, threshold
+):
+    # Extracts the methylation data for all assays of one file. Runs in a worker process.
+
+    # print study_id when loading each file
+    print(f"processing: {study_ids[0]}")
+
+    # skip assays if expected columns are missing
+    available = set(columns)
+    assays = [
+        (study_id, identifier, f"meth.diff_{f}", f"qvalue_{f}")
+        for study_id, f, identifier in zip(study_ids, factors, identifiers)
+        if {f"meth.diff_{f}", f"qvalue_{f}"}.issubset(available)
+    ]
+    if not assays:
+        return None
+
+    # read only the columns required for the assays of this file
+    region_cols = ["ENTREZID", "chr", "start", "end", "dist.to.feature", "prom", "exon", "intron"]
+    diff_cols = [diff_col for _, _, diff_col, _ in assays]
+    qv_cols = [qv_col for _, _, _, qv_col in assays]
+    usecols = list(dict.fromkeys(region_cols + diff_cols + qv_cols))
+    df = read_dataset_file(dataset_path, filename, columns=usecols)
+
+    # drop NA and filter by q‑value threshold for all contrasts at once
+    methylation_diff = df[diff_cols].to_numpy(dtype=float)
+    q_value = df[qv_cols].to_numpy(dtype=float)
+    mask = (
+        df[region_cols].notna().all(axis=1).to_numpy()[:, None]
+        & ~np.isnan(methylation_diff)
+        & ~np.isnan(q_value)
+        & (q_value <= threshold)
+    )
+
+    for (study_id, _, diff_col, _), count in zip(assays, mask.sum(axis=0)):
+        if count == 0:
+            print(f"No significant data for {study_id}: {diff_col}")
+
+    # order the results by assay, then by row in the file
+    assay_idx, row_idx = np.nonzero(mask.T)
+    if len(row_idx) == 0:
+        return None
+
+    # compute the region columns once for each region that passed the filter in any contrast
+    region_rows = np.unique(row_idx)
+    regions = df[region_cols].iloc[region_rows].rename(
+        columns={"prom": "in_promoter", "exon": "in_exon", "intron": "in_intron"}
+    )
+
+    # map 0/1 → 'false'/'true'
+    neo4j_bool = {1: "true", 0: "false"}
+    regions["in_promoter"] = regions["in_promoter"].map(neo4j_bool)
+    regions["in_exon"] = regions["in_exon"].map(neo4j_bool)
+    regions["in_intron"] = regions["in_intron"].map(neo4j_bool)
+    regions["methylation_id"] = (
+        regions["chr"] + ":" + regions["start"].astype(str) + "-" + regions["end"].astype(str)
+    )
+
+    # expand the regions to one row per assay and region
+    result = regions.iloc[np.searchsorted(region_rows, row_idx)].reset_index(drop=True)
+    result["methylation_diff"] = methylation_diff[row_idx, assay_idx]
+    result["q_value"] = q_value[row_idx, assay_idx]
+    result["assay_id"] = np.array([identifier for _, identifier, _, _ in assays], dtype=object)[assay_idx]
+
+    return result
+
+
+def list_to_string(df, sample_size=100):
+    for col in list_columns(df, sample_size):
+        df[col] = join_lists(df[col])
 
     return df
 
 
-def save_dataframe_to_kg(df, node_or_rel_name, node_or_rel_directory):
-    # Remove previous versions of the node or relationship file
-    for file_path in glob.glob(os.path.join(node_or_rel_directory, f"{node_or_rel_name}_*.csv")):
-        os.remove(file_path)
+def list_columns(df, sample_size=100):
+    # Names of the columns that only contain lists
+    columns = []
+    for col in df.columns:
+        # Only object columns can hold lists. Check a sample of the column
+        # before scanning all of its values.
+        if df[col].dtype != object:
+            continue
+        if not all(isinstance(x, list) for x in df[col].head(sample_size)):
+            continue
+        if all(isinstance(x, list) for x in df[col]):
+            columns.append(col)
+    return columns
+
+
+def join_lists(values):
+    # Convert lists to "|" separated strings (required for Neo4j import)
+    return ["|".join(map(str, x)) for x in values]
 
-    # Convert any column of type list to a "|" separated string (required for Neo4j import)
-    df = list_to_string(df)
 
-    # Remove duplicate nodes or relationships
+def find_duplicates(df, subset):
+    """
+    Mark rows with duplicate values in the `subset` columns, keeping the first occurrence.
+
+    The rows are compared by 64-bit hashes of their keys instead of sorting or
+    factorizing all key columns. Duplicates are confirmed by comparing the key
+    values with the first occurrence to rule out hash collisions.
+
+    Returns
+    -------
+    numpy.ndarray: Boolean array that is True for duplicate rows.
+    """
+    hashes = pd.util.hash_pandas_object(df[subset], index=False).to_numpy()
+    duplicated = pd.Series(hashes).duplicated().to_numpy(copy=True)
+
+    if duplicated.any():
+        positions = np.flatnonzero(duplicated)
+        first = pd.Series(np.flatnonzero(~duplicated), index=hashes[~duplicated])
+        first_positions = first.loc[hashes[positions]].to_numpy()
+
+        same = np.ones(len(positions), dtype=bool)
+        for col in subset:
+            values = df[col].to_numpy()
+            a = values[positions]
+            b = values[first_positions]
+            same &= (a == b) | (pd.isna(a) & pd.isna(b))
+        duplicated[positions[~same]] = False
+
+    return duplicated
+
+
+def save_dataframe_to_kg(
+    df,
+    node_or_rel_name,
+    node_or_rel_directory,
+    inputs=None,
+    params=None,
+    chunksize=1_000_000,
+    split_header=None,
+    compression=None,
+    return_data=True,
+):
+    """
+    Save a node or relationship DataFrame as a CSV file in the KG directory.
+
+    Duplicate nodes or relationships are dropped and columns of lists are written as
+    "|" separated strings. Both are applied one chunk at a time while the file is written,
+    so `df` isn't modified or copied.
+
+    Each file is tracked with a fingerprint in the sidecar manifest "fingerprints.json"
+    of the KG directory. If the fingerprint matches the previous build, the existing file
+    is kept and nothing is written.
+
+    Parameters
+    ----------
+    df (pandas.DataFrame): Nodes (with an "identifier" column) or relationships (with "from" and "to" columns).
+    node_or_rel_name (str): Name of the node or relationship, e.g. "Study" or "Study-PERFORMED_SpAS-Assay".
+    node_or_rel_directory (str): KG directory for nodes or relationships.
+    inputs (list): Input files the data was derived from. If given, the fingerprint is computed
+        from these files (path, size, modification time) instead of the content of `df`.
+    params (dict): Parameters the data depends on, e.g. {"threshold": 0.05}.
+    chunksize (int): Number of rows written to the CSV file at a time.
+    split_header (bool): If True, write the data without a header line and the header to a
+        separate "<file>.header" file. Such files can be linked into the Neo4j import directory
+        without copying them. Defaults to the KG_SPLIT_HEADER environment variable (true/false).
+    compression (str): "gzip" to write a gzip compressed "<file>.csv.gz" file, which neo4j-admin
+        reads natively, or "" for plain CSV. Defaults to the KG_COMPRESSION environment variable.
+        The header file of a split header is never compressed.
+    return_data (bool): If False, return None. Otherwise, if `df` has duplicates, a deduplicated
+        copy of `df` is made after the file has been written.
+
+    Returns
+    -------
+    pandas.DataFrame: The rows of `df` that were saved (without duplicates).
+    """
+    # Columns of type list are converted to "|" separated strings (required for Neo4j import)
+    list_cols = list_columns(df)
+
+    # Find duplicate nodes or relationships
     if "identifier" in df.columns and "nodes" in node_or_rel_directory:
-        df = df.drop_duplicates(subset="identifier")
+        duplicated = find_duplicates(df, ["identifier"])
     elif {"from", "to"}.issubset(df.columns) and "relationships" in node_or_rel_directory:
-        df = df.drop_duplicates(subset=["from", "to"])
+        duplicated = find_duplicates(df, ["from", "to"])
     else:
         raise ValueError(
             f"Invalid node or relationship file {list(df.columns)} or directory {node_or_rel_directory}. See https://github.com/sbl-sdsc/kg-import for details."
         )
 
+    n_duplicates = int(duplicated.sum())
+    n_rows = len(df) - n_duplicates
+
+    def chunks():
+        # The rows to save, one chunk at a time
+        for start in range(0, max(len(df), 1), chunksize):
+            chunk = df.iloc[start : start + chunksize]
+            if n_duplicates > 0:
+                chunk = chunk[~duplicated[start : start + chunksize]]
+            if list_cols:
+                chunk = chunk.assign(**{col: join_lists(chunk[col]) for col in list_cols})
+            yield chunk
+
+    def saved_rows():
+        if not return_data:
+            return None
+        return df[~duplicated] if n_duplicates > 0 else df
+
+    layout = kg_file_layout(split_header, compression)
+    split_header = layout["split_header"]
+    compression = layout["compression"]
+
+    fingerprint = compute_fingerprint(None if inputs else chunks(), inputs=inputs, params=params)
+    fingerprints = load_fingerprints(node_or_rel_directory)
+    previous = fingerprints.get(node_or_rel_name, {})
+
+    if (
+        previous.get("fingerprint") == fingerprint
+        and {"split_header": False, "compression": None, **previous.get("layout", {})} == layout
+        and os.path.exists(os.path.join(node_or_rel_directory, previous.get("file", "")))
+    ):
+        print(f"Unchanged: {previous['file']}")
+        previous["changed"] = False
+        save_fingerprints(node_or_rel_directory, fingerprints)
+        return saved_rows()
+
+    # Remove previous versions of the node or relationship file (and header file)
+    for file_path in glob.glob(os.path.join(node_or_rel_directory, f"{node_or_rel_name}_*.csv*")):
+        os.remove(file_path)
+
     update_date = datetime.today().strftime("%Y-%d-%m")
-    df.to_csv(
-        os.path.join(node_or_rel_directory, f"{node_or_rel_name}_{update_date}.csv"),
-        index=False,
+    filename = f"{node_or_rel_name}_{update_date}.csv"
+    if compression == "gzip":
+        filename += ".gz"
+
+    # Stream the rows to disk in chunks
+    start_time = time.perf_counter()
+    file_path = os.path.join(node_or_rel_directory, filename)
+    opener = gzip.open if compression == "gzip" else open
+    with opener(file_path, "wt", newline="") as f:
+        for i, chunk in enumerate(chunks()):
+            chunk.to_csv(f, index=False, header=i == 0 and not split_header)
+    n_bytes = os.path.getsize(file_path)
+
+    if split_header:
+        df.head(0).to_csv(f"{file_path}.header", index=False)
+    elapsed = max(time.perf_counter() - start_time, 1e-9)
+
+    print(
+        f"Updated: {filename} ({n_rows} rows written, {n_duplicates} duplicates dropped, "
+        f"{n_bytes / 1e6 / elapsed:.1f} MB/s)"
     )
 
-    return df
+    fingerprints[node_or_rel_name] = {
+        "file": filename,
+        "fingerprint": fingerprint,
+        "rows": n_rows,
+        "layout": layout,
+        "updated": datetime.now().isoformat(timespec="seconds"),
+        "changed": True,
+    }
+    save_fingerprints(node_or_rel_directory, fingerprints)
+
+    return saved_rows()
+
+
+def compute_fingerprint(df, inputs=None, params=None):
+    """
+    Compute a SHA-256 fingerprint of a KG file from its input files and parameters,
+    or from the content of the DataFrame if no input files are given. `df` may also
+    be an iterable of DataFrame chunks, which gives the same fingerprint as the whole DataFrame.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+
+    if inputs:
+        for path in sorted(inputs):
+            stat = os.stat(path)
+            h.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    else:
+        chunks = [df] if isinstance(df, pd.DataFrame) else df
+        for i, chunk in enumerate(chunks):
+            if i == 0:
+                h.update(json.dumps([str(col) for col in chunk.columns]).encode())
+            h.update(pd.util.hash_pandas_object(chunk, index=False).values.tobytes())
+
+    return h.hexdigest()
+
+
+def kg_file_layout(split_header=None, compression=None):
+    # Layout of a KG file. Unspecified options are read from the
+    # KG_SPLIT_HEADER and KG_COMPRESSION environment variables.
+    if split_header is None:
+        split_header = os.getenv("KG_SPLIT_HEADER", "false").lower() == "true"
+    if compression is None:
+        compression = os.getenv("KG_COMPRESSION", "")
+    compression = compression or None
+    if compression not in (None, "gzip"):
+        raise ValueError(f"Unsupported compression {compression!r}, use 'gzip' or None")
+    return {"split_header": split_header, "compression": compression}
+
+
+def is_kg_file_current(
+    node_or_rel_name, node_or_rel_directory, inputs, params=None, split_header=None, compression=None
+):
+    """
+    Return True if the KG file was built from the same input files and parameters
+    in the same layout, so that the data doesn't need to be extracted again.
+    """
+    entry = load_fingerprints(node_or_rel_directory).get(node_or_rel_name, {})
+    layout = {"split_header": False, "compression": None, **entry.get("layout", {})}
+    return (
+        entry.get("fingerprint") == compute_fingerprint(None, inputs=inputs, params=params)
+        and layout == kg_file_layout(split_header, compression)
+        and os.path.exists(os.path.join(node_or_rel_directory, entry.get("file", "")))
+    )
+
+
+def read_kg_file(node_or_rel_name, node_or_rel_directory):
+    """
+    Read the current KG file of a node or relationship, e.g. to reuse it when
+    is_kg_file_current() shows that it doesn't need to be rebuilt.
+
+    Returns
+    -------
+    pandas.DataFrame: The rows of the file with all values as strings.
+    """
+    entry = load_fingerprints(node_or_rel_directory)[node_or_rel_name]
+    file_path = os.path.join(node_or_rel_directory, entry["file"])
+
+    if entry.get("layout", {}).get("split_header"):
+        names = pd.read_csv(f"{file_path}.header", nrows=0).columns
+        return pd.read_csv(file_path, header=None, names=names, dtype=str, keep_default_na=False)
+    return pd.read_csv(file_path, dtype=str, keep_default_na=False)
+
+
+def load_fingerprints(node_or_rel_directory):
+    path = os.path.join(node_or_rel_directory, "fingerprints.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_fingerprints(node_or_rel_directory, fingerprints):
+    path = os.path.join(node_or_rel_directory, "fingerprints.json")
+    with open(f"{path}.part", "w") as f:
+        json.dump(fingerprints, f, indent=2, sort_keys=True)
+    os.replace(f"{path}.part", path)
+
+
+def get_kg_changes(node_dir, rel_dir):
+    """
+    Report the KG files and whether they changed in the most recent build.
+
+    Returns
+    -------
+    pandas.DataFrame: One row per KG file with the columns "name", "file", "rows", "updated", and "changed".
+    """
+    entries = []
+    for directory in [node_dir, rel_dir]:
+        for name, entry in load_fingerprints(directory).items():
+            entries.append({"name": name, **entry})
+
+    columns = ["name", "file", "rows", "updated", "changed"]
+    return pd.DataFrame(entries, columns=columns + ["fingerprint"])[columns]
@@ -0,0 +1,245 @@
+"""
+This module provides HTTP helpers shared by the download functions:
+a connection-pooled requests session, a thread-safe rate limiter,
+and a persistent response cache.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def create_session(pool_size=10, retries=3):
+    """
+    Create a requests session that reuses connections across requests and threads.
+
+    Parameters
+    ----------
+    pool_size : int
+        Maximum number of connections kept open per host. Should be at least
+        the number of threads sharing the session.
+    retries : int
+        Number of retries for connection errors and transient server errors (429, 5xx).
+
+    Returns
+    -------
+    requests.Session
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET", "HEAD", "POST"],
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class RateLimiter:
+    """
+    Token-bucket rate limiter that can be shared by multiple threads.
+
+    Parameters
+    ----------
+    rate : float
+        Average number of calls per second. A rate of 0 or None disables limiting.
+    burst : int
+        Maximum number of calls that may be issued back-to-back.
+
+    Example
+    -------
+    >>> limiter = RateLimiter(10)
+    >>> for url in urls:
+    >>>     limiter.acquire()  # blocks until a token is available
+    >>>     requests.get(url)
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ResponseCache:
+    """
+    Persistent HTTP response cache keyed by URL.
+
+    Responses are stored as files in `directory` together with an index of their
+    ETag and Last-Modified headers. Within the time-to-live a cached response is
+    returned without contacting the server. After it expires, the response is
+    revalidated with a conditional request and only downloaded again if it changed.
+    When the cache exceeds `max_size` bytes, the least recently used responses are evicted.
+
+    Access times of cache hits are only kept in memory. They are written to the index
+    together with the next new response, or by `flush` (called at exit).
+
+    Parameters
+    ----------
+    directory : str
+        Directory where the cached responses are stored.
+    ttl : float
+        Time-to-live in seconds before a cached response is revalidated.
+    max_size : int
+        Maximum total size of the cached responses in bytes.
+    offline : bool
+        If True, only serve responses from the cache and never contact the server.
+    """
+
+    def __init__(self, directory, ttl=24 * 3600, max_size=1_000_000_000, offline=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+        self.index_path = os.path.join(directory, "index.json")
+        self.lock = threading.Lock()
+        self.index = {}
+        self.dirty = False  # the index has changes that are not saved
+
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError):
+                print(f"Warning: could not read cache index {self.index_path!r}, starting with an empty cache")
+
+        atexit.register(self.flush)
+
+    def get(self, url, session=None, timeout=10, limiter=None):
+        """
+        Return the body of the response for `url` as bytes.
+
+        Raises
+        ------
+        requests.exceptions.HTTPError
+            If the server returns an error status.
+        requests.exceptions.ConnectionError
+            If the cache is offline and `url` has not been cached.
+        """
+        path = self._path(url)
+        with self.lock:
+            entry = self.index.get(url)
+        if entry is not None and not os.path.exists(path):
+            entry = None
+
+        if entry is not None and (self.offline or time.time() - entry["fetched"] < self.ttl):
+            return self._read(url, path)
+
+        if self.offline:
+            raise requests.exceptions.ConnectionError(f"{url} is not cached (offline mode)")
+
+        # Revalidate the cached response with a conditional request
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        if limiter is not None:
+            limiter.acquire()
+        response = (session or requests).get(url, headers=headers, allow_redirects=True, timeout=timeout)
+
+        if response.status_code == 304 and entry is not None:
+            with self.lock:
+                entry["fetched"] = time.time()
+                self._save_index()
+            return self._read(url, path)
+
+        response.raise_for_status()
+        content = response.content
+        self._store(url, path, content, response.headers)
+        return content
+
+    def flush(self):
+        """Save the access times of cache hits that haven't been saved yet."""
+        with self.lock:
+            if self.dirty:
+                self._save_index()
+
+    def clear(self):
+        with self.lock:
+            for url in list(self.index):
+                self._remove(url)
+            self._save_index()
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest())
+
+    def _read(self, url, path):
+        with open(path, "rb") as f:
+            content = f.read()
+        with self.lock:
+            if url in self.index:
+                self.index[url]["accessed"] = time.time()
+                self.dirty = True
+        return content
+
+    def _store(self, url, path, content, headers):
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f"{path}.part"
+            with open(temp_path, "wb") as f:
+                f.write(content)
+            os.replace(temp_path, path)
+
+            now = time.time()
+            self.index[url] = {
+                "etag": headers.get("ETag", ""),
+                "last_modified": headers.get("Last-Modified", ""),
+                "size": len(content),
+                "fetched": now,
+                "accessed": now,
+            }
+            self._evict()
+            self._save_index()
+
+    def _evict(self):
+        # Remove the least recently used responses until the cache fits into max_size
+        total = sum(entry["size"] for entry in self.index.values())
+        for url in sorted(self.index, key=lambda u: self.index[u]["accessed"]):
+            if total <= self.max_size:
+                break
+            total -= self.index[url]["size"]
+            self._remove(url)
+
+    def _remove(self, url):
+        self.index.pop(url, None)
+        path = self._path(url)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{self.index_path}.part"
+        with open(temp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(temp_path, self.index_path)
+        self.dirty = False
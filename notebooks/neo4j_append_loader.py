@@ -0,0 +1,409 @@
+"""
+This module adds new studies to a running Neo4j database without a full re-import.
+Only the node and relationship rows that belong to the new studies are selected
+from the KG files. They are upserted with batched, parameterized UNWIND ... MERGE
+statements and typed with the KG metadata.
+"""
+
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from dotenv import load_dotenv
+
+import neo4j_bulk_importer as importer
+
+# Metadata types that are converted from strings by a Cypher function
+TEMPORAL_TYPES = {"date", "datetime", "localdatetime", "time", "localtime", "duration"}
+
+
+def append_studies(study_ids, data=None, metadata=None, database=None, batch_size=10_000, max_workers=4, study_label="Study"):
+    """
+    Upsert the nodes and relationships of new studies into a running Neo4j database.
+
+    The rows are selected with select_study_rows() and written in batches of `batch_size` rows.
+    Each batch is one UNWIND ... MERGE transaction. The batches of a node or relationship file
+    run in parallel, and transactions that fail with a transient error (e.g., a deadlock) are retried.
+    All nodes are loaded before the relationships. MERGE uses the indices created by add_indices()
+    for the node identifiers, and rows that already exist in the database are updated.
+
+    Parameters
+    ----------
+    study_ids (list): Accessions of the new studies, e.g. ["OSD-47"].
+    data (str): KG directory with "nodes" and "relationships" subdirectories.
+        Defaults to the NEO4J_DATA environment variable.
+    metadata (str): Metadata directory with "nodes" and "relationships" subdirectories.
+        Defaults to the NEO4J_METADATA environment variable.
+    database (str): Name of the database. Defaults to the NEO4J_DATABASE environment variable.
+    batch_size (int): Number of rows per transaction.
+    max_workers (int): Number of transactions that run concurrently.
+    study_label (str): Node label of the studies.
+
+    Returns
+    -------
+    pandas.DataFrame: One row per node and relationship file with the number of rows, batches, and the load time in seconds.
+
+    Example
+    -------
+    >>> append_studies(["OSD-679"], batch_size=5000, max_workers=8)
+    """
+    load_dotenv("../.env", override=True)
+    metadata = metadata or os.getenv("NEO4J_METADATA")
+    database = database or os.getenv("NEO4J_DATABASE")
+
+    node_types, relationship_types = read_metadata(metadata)
+    nodes, relationships, _ = select_study_rows(study_ids, data=data, metadata=metadata, study_label=study_label, max_workers=max_workers)
+
+    graph = importer.get_graph(database)
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for label, df in nodes.items():
+            key = next(iter(node_types[label]))
+            df = df.drop_duplicates(subset=key)
+            cypher = node_cypher(label, node_types[label])
+            results.append(load_rows(graph, label, cypher, to_rows(df, node_types[label]), batch_size, executor))
+
+        for name, df in relationships.items():
+            source, _, target = name
+            # Sorted rows let each transaction lock fewer start nodes
+            df = df.sort_values(["from", "to"])
+            cypher = relationship_cypher(name, relationship_types[name], node_types[source], node_types[target])
+            results.append(load_rows(graph, "-".join(name), cypher, to_rows(df, relationship_types[name]), batch_size, executor))
+
+    return pd.DataFrame(results, columns=["name", "rows", "batches", "time"])
+
+
+def remove_studies(study_ids, data=None, metadata=None, database=None, batch_size=10_000, study_label="Study"):
+    """
+    Remove the nodes of studies that were added with append_studies() together with their relationships.
+
+    Nodes that are shared with other studies are kept.
+
+    Returns
+    -------
+    int: Number of nodes that were selected for removal.
+    """
+    load_dotenv("../.env", override=True)
+    metadata = metadata or os.getenv("NEO4J_METADATA")
+    database = database or os.getenv("NEO4J_DATABASE")
+
+    node_types, _ = read_metadata(metadata)
+    _, _, new_nodes = select_study_rows(study_ids, data=data, metadata=metadata, study_label=study_label)
+
+    graph = importer.get_graph(database)
+    n_nodes = 0
+    for label, ids in new_nodes.items():
+        key = next(iter(node_types[label]))
+        cypher = f"UNWIND $rows AS id MATCH (n:{quote(label)} {{{quote(key)}: id}}) DETACH DELETE n"
+        ids = sorted(ids)
+        for start in range(0, len(ids), batch_size):
+            graph.update(cypher, {"rows": ids[start : start + batch_size]})
+        n_nodes += len(ids)
+        print(f"Removed: {label} ({len(ids)} nodes)", flush=True)
+
+    return n_nodes
+
+
+def select_study_rows(study_ids, data=None, metadata=None, study_label="Study", max_workers=4):
+    """
+    Select the node and relationship rows of the KG that belong to new studies.
+
+    The nodes of a study are the nodes reachable from it along the direction of the relationships.
+    New nodes are reachable from the new studies but not from any other study of the KG, so they
+    are not in the database yet. The selection contains all relationships with a new start or end
+    node and the nodes at both ends of these relationships, except nodes of the other studies,
+    which already exist.
+
+    Only the identifier columns are read to find the new nodes. The files are then read again
+    in chunks, and only the selected rows are kept.
+
+    Returns
+    -------
+    tuple: (nodes, relationships, new_nodes)
+        nodes (dict): Node label -> DataFrame with the selected rows.
+        relationships (dict): (source, relationship, target) -> DataFrame with the selected rows.
+        new_nodes (dict): Node label -> set of the identifiers of the new nodes.
+    """
+    data = data or os.getenv("NEO4J_DATA")
+    metadata = metadata or os.getenv("NEO4J_METADATA")
+    if isinstance(study_ids, str):
+        study_ids = [study_ids]
+
+    start_time = time.perf_counter()
+    node_types, relationship_types = read_metadata(metadata)
+    node_files, relationship_files = kg_files(data)
+
+    # Files without metadata are not imported by the bulk import either
+    for label in [label for label in node_files if label not in node_types]:
+        print(f"No metadata for node {label}, skipped")
+        del node_files[label]
+    for name in [name for name in relationship_files if name not in relationship_types or not {name[0], name[2]} <= node_types.keys()]:
+        print(f"No metadata for relationship {'-'.join(name)}, skipped")
+        del relationship_files[name]
+
+    if study_label not in node_files:
+        raise ValueError(f"No {study_label} node file in {data}")
+    study_key = next(iter(node_types[study_label]))
+    study_nodes = read_kg_files({study_label: node_files[study_label]}, columns={study_label: [study_key]}, max_workers=max_workers)
+    studies = set(study_nodes[study_label][study_key])
+    new_studies = set(study_ids)
+    missing = new_studies - studies
+    if missing:
+        raise ValueError(f"Studies not found in the KG: {sorted(missing)}")
+
+    # Only the start and end nodes of the relationships are needed to find the new nodes
+    edges = read_kg_files(relationship_files, columns={name: ["from", "to"] for name in relationship_files}, max_workers=max_workers)
+    new_reachable = forward_closure({study_label: new_studies}, edges)
+    old_reachable = forward_closure({study_label: studies - new_studies}, edges)
+    del edges
+    new_nodes = {label: ids - old_reachable.get(label, set()) for label, ids in new_reachable.items()}
+    new_nodes = {label: ids for label, ids in new_nodes.items() if ids}
+
+    # Relationships with a new start or end node and their end points
+    def select_relationships(name, chunk):
+        source, _, target = name
+        return chunk[chunk["from"].isin(new_nodes.get(source, set())) | chunk["to"].isin(new_nodes.get(target, set()))]
+
+    files = {name: paths for name, paths in relationship_files.items() if name[0] in new_nodes or name[2] in new_nodes}
+    relationships = read_kg_files(files, select=select_relationships, max_workers=max_workers)
+    relationships = {name: df for name, df in relationships.items() if len(df) > 0}
+    end_points = {}
+    for (source, _, target), df in relationships.items():
+        end_points.setdefault(source, set()).update(df["from"])
+        end_points.setdefault(target, set()).update(df["to"])
+
+    # New nodes and the end points that are not nodes of the other studies
+    ids = {}
+    for label in node_files:
+        ids[label] = new_nodes.get(label, set()) | (end_points.get(label, set()) - old_reachable.get(label, set()))
+
+    def select_nodes(label, chunk):
+        return chunk[chunk[next(iter(node_types[label]))].isin(ids[label])]
+
+    files = {label: paths for label, paths in node_files.items() if ids[label]}
+    nodes = read_kg_files(files, select=select_nodes, max_workers=max_workers)
+    nodes = {label: df for label, df in nodes.items() if len(df) > 0}
+
+    n_nodes = sum(len(df) for df in nodes.values())
+    n_relationships = sum(len(df) for df in relationships.values())
+    print(f"Selected {n_nodes} nodes and {n_relationships} relationships of {len(new_studies)} new studies "
+          f"in {time.perf_counter() - start_time:.1f} s", flush=True)
+
+    return nodes, relationships, new_nodes
+
+
+def forward_closure(seeds, relationships):
+    """
+    Return the nodes reachable from the `seeds` (node label -> set of identifiers) along the relationships.
+    """
+    reachable = {label: set(ids) for label, ids in seeds.items()}
+    frontier = reachable
+    while frontier:
+        next_frontier = {}
+        for (source, _, target), df in relationships.items():
+            if not frontier.get(source):
+                continue
+            targets = set(df["to"][df["from"].isin(frontier[source])])
+            targets -= reachable.get(target, set())
+            if targets:
+                next_frontier.setdefault(target, set()).update(targets)
+        for label, ids in next_frontier.items():
+            reachable.setdefault(label, set()).update(ids)
+        frontier = next_frontier
+    return reachable
+
+
+def read_metadata(metadata):
+    """
+    Read the property types of the nodes and relationships from the metadata files.
+
+    Returns
+    -------
+    tuple: (node_types, relationship_types)
+        node_types (dict): Node label -> {property: type}. The first property is the node identifier.
+        relationship_types (dict): (source, relationship, target) -> {property: type}.
+    """
+    node_types = {}
+    for filename in sorted(os.listdir(os.path.join(metadata, "nodes"))):
+        if filename.endswith(".csv"):
+            df = pd.read_csv(os.path.join(metadata, "nodes", filename), dtype=str, keep_default_na=False)
+            node_types[node_label(filename)] = dict(zip(df["property"], df["type"]))
+
+    relationship_types = {}
+    for filename in sorted(os.listdir(os.path.join(metadata, "relationships"))):
+        if filename.endswith(".csv"):
+            df = pd.read_csv(os.path.join(metadata, "relationships", filename), dtype=str, keep_default_na=False)
+            relationship_types[relationship_name(filename)] = dict(zip(df["property"], df["type"]))
+
+    return node_types, relationship_types
+
+
+def kg_files(data):
+    """
+    List the node and relationship files of the KG.
+
+    Returns
+    -------
+    tuple: (node_files, relationship_files)
+        node_files (dict): Node label -> list of file paths.
+        relationship_files (dict): (source, relationship, target) -> list of file paths.
+    """
+    node_files = {}
+    for file in importer.data_files(os.path.join(data, "nodes")):
+        node_files.setdefault(node_label(file.name), []).append(file)
+    relationship_files = {}
+    for file in importer.data_files(os.path.join(data, "relationships")):
+        relationship_files.setdefault(relationship_name(file.name), []).append(file)
+    return node_files, relationship_files
+
+
+def read_kg_files(files, columns=None, select=None, max_workers=4, chunksize=100_000):
+    """
+    Read node or relationship files of the KG as strings.
+
+    The files are read in chunks of `chunksize` rows, so only the selected columns and rows are kept in memory.
+
+    Parameters
+    ----------
+    files (dict): Node label or relationship name -> list of file paths, as returned by kg_files().
+    columns (dict): Node label or relationship name -> columns to read. Defaults to all columns.
+    select (callable): Called with the node label or relationship name and a chunk, returns the rows to keep.
+        Defaults to all rows.
+    max_workers (int): Number of files that are read concurrently.
+    chunksize (int): Number of rows per chunk.
+
+    Returns
+    -------
+    dict: Node label or relationship name -> DataFrame.
+    """
+    def read(key, path):
+        usecols = columns.get(key) if columns else None
+        dfs = []
+        for chunk in read_data_file(path, usecols=usecols, chunksize=chunksize):
+            dfs.append(select(key, chunk) if select else chunk)
+        return pd.concat(dfs, ignore_index=True)
+
+    items = [(key, path) for key, paths in files.items() for path in paths]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda item: read(*item), items))
+
+    frames = {}
+    for (key, _), df in zip(items, results):
+        frames.setdefault(key, []).append(df)
+    return {key: pd.concat(dfs, ignore_index=True) for key, dfs in frames.items()}
+
+
+def count_kg_rows(data, max_workers=4):
+    """
+    Return the number of node and relationship rows in the KG. Only the first column of each file is read.
+    """
+    node_files, relationship_files = kg_files(data)
+    files = {**node_files, **relationship_files}
+    dfs = read_kg_files(files, columns={key: [0] for key in files}, max_workers=max_workers)
+    return sum(len(df) for df in dfs.values())
+
+
+def read_data_file(path, usecols=None, chunksize=None):
+    # Data files without a header line have a separate header file
+    header_path = f"{path}.header"
+    if os.path.exists(header_path):
+        names = pd.read_csv(header_path, nrows=0).columns
+        return pd.read_csv(path, dtype=str, keep_default_na=False, header=None, names=names, usecols=usecols, chunksize=chunksize)
+    return pd.read_csv(path, dtype=str, keep_default_na=False, usecols=usecols, chunksize=chunksize)
+
+
+def node_label(filename):
+    return re.split(r"\.|_", filename)[0]
+
+
+def relationship_name(filename):
+    # e.g. "Study-PERFORMED_SpAS-Assay_2025-01-01.csv" -> ("Study", "PERFORMED_SpAS", "Assay")
+    parts = filename.split(".")[0].split("-", 2)
+    return parts[0], parts[1], parts[2].split("_")[0]
+
+
+def node_cypher(label, types):
+    key, *properties = types
+    cypher = f"UNWIND $rows AS row MERGE (n:{quote(label)} {{{quote(key)}: row.{quote(key)}}})"
+    if properties:
+        cypher += " SET " + ", ".join(f"n.{quote(prop)} = {value_expression(prop, types[prop])}" for prop in properties)
+    return cypher
+
+
+def relationship_cypher(name, types, source_types, target_types):
+    source, relationship, target = name
+    start, end, *properties = types
+    cypher = (
+        f"UNWIND $rows AS row "
+        f"MATCH (a:{quote(source)} {{{quote(next(iter(source_types)))}: row.{quote(start)}}}) "
+        f"MATCH (b:{quote(target)} {{{quote(next(iter(target_types)))}: row.{quote(end)}}}) "
+        f"MERGE (a)-[r:{quote(relationship)}]->(b)"
+    )
+    if properties:
+        cypher += " SET " + ", ".join(f"r.{quote(prop)} = {value_expression(prop, types[prop])}" for prop in properties)
+    return cypher
+
+
+def value_expression(prop, neo4j_type):
+    # Temporal values are sent as strings and converted by Cypher
+    base_type = neo4j_type.removesuffix("[]")
+    if base_type not in TEMPORAL_TYPES:
+        return f"row.{quote(prop)}"
+    if neo4j_type.endswith("[]"):
+        return f"[value IN row.{quote(prop)} | {base_type}(value)]"
+    return f"{base_type}(row.{quote(prop)})"
+
+
+def quote(name):
+    return "`" + name.replace("`", "``") + "`"
+
+
+def to_rows(df, types):
+    """
+    Convert the string columns of a node or relationship DataFrame to a list of parameter maps
+    with values of the metadata types. Empty fields are None, as in the bulk import.
+    """
+    columns = [column for column in df.columns if column in types]
+    values = [typed_values(df[column].tolist(), types[column]) for column in columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def typed_values(values, neo4j_type):
+    # Array values are separated by "|" (neo4j-admin --array-delimiter)
+    if neo4j_type.endswith("[]"):
+        convert = converter(neo4j_type[:-2])
+        return [[convert(item) for item in value.split("|")] if value != "" else None for value in values]
+    convert = converter(neo4j_type)
+    return [convert(value) if value != "" else None for value in values]
+
+
+def converter(neo4j_type):
+    if neo4j_type in ("int", "long", "short", "byte"):
+        return to_int
+    if neo4j_type in ("float", "double"):
+        return float
+    if neo4j_type == "boolean":
+        return lambda value: value.lower() == "true"
+    return str
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        # Integers written from float columns, e.g. "1.0"
+        return int(float(value))
+
+
+def load_rows(graph, name, cypher, rows, batch_size, executor):
+    start_time = time.perf_counter()
+    batches = [rows[start : start + batch_size] for start in range(0, len(rows), batch_size)]
+    futures = [executor.submit(graph.update, cypher, {"rows": batch}) for batch in batches]
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - start_time
+
+    print(f"Loaded: {name} ({len(rows)} rows, {len(batches)} batches, {len(rows) / max(elapsed, 1e-9):.0f} rows/s)", flush=True)
+    return {"name": name, "rows": len(rows), "batches": len(batches), "time": round(elapsed, 3)}
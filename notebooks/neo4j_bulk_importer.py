@@ -1,17 +1,24 @@
 import os
 import sys
 import time
+import gzip
 import shutil
 from pathlib import Path
 from dotenv import load_dotenv
-import papermill as pm
 import subprocess
 import neo4j_utils
+import prepare_neo4j_bulk_import
+
+# Graph connections of the Bolt backend by database name, see get_graph()
+_graphs = {}
+
+# Maximum time in seconds to wait for a database to come online or for indices to be populated
+INDEX_TIMEOUT = 3600
 
 
 def import_from_csv_to_neo4j_community(verbose=False):
     setup()
-    pm.execute_notebook("PrepareNeo4jBulkImport.ipynb", "PrepareNeo4jBulkImport_out.ipynb");
+    prepare_bulk_import()
     run_bulk_import(verbose=verbose)
     neo4j_utils.start()
     add_indices(verbose=verbose)
@@ -20,7 +27,7 @@ def import_from_csv_to_neo4j_community(verbose=False):
 def import_from_csv_to_neo4j_desktop(verbose=False):
     setup()
     drop_database(verbose=verbose)
-    pm.execute_notebook("PrepareNeo4jBulkImport.ipynb", "PrepareNeo4jBulkImport_out.ipynb");
+    prepare_bulk_import()
     run_bulk_import(verbose=verbose)
     create_database(verbose=verbose)
     add_indices(verbose=verbose)
@@ -30,15 +37,30 @@ def import_from_csv_to_neo4j_enterprise(verbose=False):
     setup()
     run_cypher("pre", verbose=verbose)
     drop_database(verbose=verbose)
-    pm.execute_notebook("PrepareNeo4jBulkImport.ipynb", "PrepareNeo4jBulkImport_out.ipynb");
+    prepare_bulk_import()
     run_bulk_import(verbose=verbose)
     create_database(verbose=verbose)
     add_indices(verbose=verbose)
     run_cypher("post", verbose=verbose)
 
 
-def setup():
+def prepare_bulk_import(data_dir=None):
+    # Create the header files, metadata nodes and relationships, args.txt, and indices.cypher in the import directory
+    start = time.perf_counter()
+    prepare_neo4j_bulk_import.prepare_bulk_import(data=data_dir)
+    print(f"Prepared bulk import in {time.perf_counter() - start:.2f} s", flush=True)
+
+
+def setup(compression=None, data_dir=None):
     load_dotenv('../.env', override=True)
+    # Staged copies are gzip compressed if compression="gzip" (neo4j-admin reads .csv.gz files natively),
+    # and copied as they are if compression="". Defaults to the NEO4J_IMPORT_COMPRESSION environment variable.
+    if compression is None:
+        compression = os.getenv("NEO4J_IMPORT_COMPRESSION", "")
+    compression = compression or None
+    if compression not in (None, "gzip"):
+        sys.exit(f"Unsupported compression: {compression}, use gzip")
+
     # Check environment variables and directory structure   
     NEO4J_HOME = os.getenv("NEO4J_HOME")
     if not NEO4J_HOME:
@@ -68,7 +90,8 @@ def setup():
     if not os.path.exists(NEO4J_METADATA_RELATIONSHIPS):
         sys.exit(f"Metadata directory not found: {NEO4J_METADATA_RELATIONSHIPS}")
     
-    NEO4J_DATA = os.getenv("NEO4J_DATA")
+    # The data files are staged from data_dir instead of NEO4J_DATA if given
+    NEO4J_DATA = data_dir or os.getenv("NEO4J_DATA")
     if not os.path.exists(NEO4J_DATA):
         sys.exit(f"Data directory not found: {NEO4J_DATA}")
     
@@ -82,8 +105,9 @@ def setup():
 
     # Clean import directory
 
-    for file in Path(NEO4J_IMPORT).glob('*.csv'):
-        os.remove(file)
+    for pattern in ('*.csv', '*.csv.gz'):
+        for file in Path(NEO4J_IMPORT).glob(pattern):
+            os.remove(file)
 
     # args.txt contains arguments for the neo4j_admin tool
     if os.path.exists(os.path.join(NEO4J_IMPORT, "args.txt")):
@@ -95,20 +119,56 @@ def setup():
     if os.path.exists(os.path.join(NEO4J_IMPORT, "import.report")):
         os.remove(os.path.join(NEO4J_IMPORT, "import.report"))
 
-    # Copy data and metadata files into the import directory
+    # Stage data files in the import directory
     # The header line is removed since the column names and types are provided in a separate file for bulk download.
+    # Data files that were saved without a header line are linked instead of copied.
+
+    for input_file in data_files(NEO4J_DATA_NODES):
+        stage_data_file(input_file, NEO4J_IMPORT, "_n", compression)
+
+    for input_file in data_files(NEO4J_DATA_RELATIONSHIPS):
+        stage_data_file(input_file, NEO4J_IMPORT, "_r", compression)
+
 
-    for input_file in Path(NEO4J_DATA_NODES).glob('*.csv'):
-        output_file = os.path.join(NEO4J_IMPORT, f"{input_file.stem}_n.csv")
-        copy_without_header(input_file, output_file)
+def data_files(directory):
+    # Plain and gzip compressed data files
+    return sorted(list(Path(directory).glob('*.csv')) + list(Path(directory).glob('*.csv.gz')))
+
+
+def stage_data_file(input_file, import_dir, suffix, compression=None):
+    name = input_file.name
+    stem = name[: -len(".csv.gz")] if name.endswith(".csv.gz") else name[: -len(".csv")]
+    extension = ".csv.gz" if name.endswith(".gz") else ".csv"
+
+    # Files with a separate header file have no header line and can be used as is
+    if os.path.exists(f"{input_file}.header"):
+        link_file(input_file, os.path.join(import_dir, f"{stem}{suffix}{extension}"))
+    else:
+        if compression == "gzip":
+            extension = ".csv.gz"
+        copy_without_header(input_file, os.path.join(import_dir, f"{stem}{suffix}{extension}"))
+
+
+def link_file(input_file, output_file):
+    # Use a hard link if the import directory is on the same file system, otherwise a symbolic link
+    try:
+        os.link(input_file, output_file)
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(input_file), output_file)
+        except OSError:
+            shutil.copyfile(input_file, output_file)
 
-    for input_file in Path(NEO4J_DATA_RELATIONSHIPS).glob('*.csv'):
-        output_file = os.path.join(NEO4J_IMPORT, f"{input_file.stem}_r.csv")
-        copy_without_header(input_file, output_file)
+
+def open_data_file(path, mode):
+    # Read and write gzip compressed files transparently
+    if str(path).endswith(".gz"):
+        return gzip.open(path, mode + 't', newline='')
+    return open(path, mode, newline='')
 
 
 def copy_without_header(input_file, output_file):
-    with open(input_file, 'r') as f_in, open(output_file, 'w') as f_out:
+    with open_data_file(input_file, 'r') as f_in, open_data_file(output_file, 'w') as f_out:
         next(f_in)  # Skip the first line
         shutil.copyfileobj(f_in, f_out)
 
@@ -156,19 +216,26 @@ def drop_database(verbose=False):
     # Cypher-shell requires database names to be quoted by tick marks if non-alphanumeric characters are in the name.
     NEO4J_DATABASE_QUOTED = f"`{NEO4J_DATABASE}`"
 
-    cypher_shell = quote_path(os.path.join(NEO4J_BIN, "cypher-shell"))
-    command = f"{cypher_shell} -d system -u {NEO4J_USERNAME} -p {NEO4J_PASSWORD} 'DROP DATABASE {NEO4J_DATABASE_QUOTED} IF EXISTS;'"
-    if verbose:
-        print(f"drop_database: {command}", flush=True)
-
-    try:
-        ret = subprocess.run(command, capture_output=True, check=True, shell=True)
+    if use_bolt():
+        try:
+            execute_cypher([f"DROP DATABASE {NEO4J_DATABASE_QUOTED} IF EXISTS"], "system", verbose=verbose)
+        except Exception:
+            print(f"ERROR: drop_database: The Graph DBMS is not running or the database name: {NEO4J_DATABASE}, username: {NEO4J_USERNAME}, or password: {NEO4J_PASSWORD} are incorrect. Start the Graph DBMS before running this script.", flush=True)
+            raise
+    else:
+        cypher_shell = quote_path(os.path.join(NEO4J_BIN, "cypher-shell"))
+        command = f"{cypher_shell} -d system -u {NEO4J_USERNAME} -p {NEO4J_PASSWORD} 'DROP DATABASE {NEO4J_DATABASE_QUOTED} IF EXISTS;'"
         if verbose:
-            print(ret.stdout.decode(), flush=True)
-    except subprocess.CalledProcessError as e:
-        print(f"ERROR: drop_database: The Graph DBMS is not running or the database name: {NEO4J_DATABASE}, username: {NEO4J_USERNAME}, or password: {NEO4J_PASSWORD} are incorrect. Start the Graph DBMS before running this script.", flush=True)
-        print(e.output)
-        raise
+            print(f"drop_database: {command}", flush=True)
+
+        try:
+            ret = subprocess.run(command, capture_output=True, check=True, shell=True)
+            if verbose:
+                print(ret.stdout.decode(), flush=True)
+        except subprocess.CalledProcessError as e:
+            print(f"ERROR: drop_database: The Graph DBMS is not running or the database name: {NEO4J_DATABASE}, username: {NEO4J_USERNAME}, or password: {NEO4J_PASSWORD} are incorrect. Start the Graph DBMS before running this script.", flush=True)
+            print(e.output)
+            raise
         
     # remove the database file
     # TODO remove the transaction files as well
@@ -207,6 +274,15 @@ def create_database(verbose=False):
     # Cypher-shell requires database names to be quoted by tick marks if non-alphanumeric characters are in the name.
     NEO4J_DATABASE_QUOTED = f"`{NEO4J_DATABASE}`"
 
+    if use_bolt():
+        try:
+            execute_cypher([f"CREATE OR REPLACE DATABASE {NEO4J_DATABASE_QUOTED}"], "system", verbose=verbose)
+            wait_for_database(NEO4J_DATABASE)
+        except Exception:
+            print(f"ERROR: create_database: The Graph DBMS is not running or the database name: {NEO4J_DATABASE}, username: {NEO4J_USERNAME}, or password: {NEO4J_PASSWORD} are incorrect.", flush=True)
+            raise
+        return
+
     # compose the cypher shell command
     cypher_shell = quote_path(os.path.join(NEO4J_BIN, "cypher-shell"))
     command = f"{cypher_shell} -d system -u {NEO4J_USERNAME} -p {NEO4J_PASSWORD} 'CREATE OR REPLACE DATABASE {NEO4J_DATABASE_QUOTED};'"
@@ -234,6 +310,18 @@ def add_indices(verbose=False):
     # Cypher-shell requires database names to be quoted by tick marks if non-alphanumeric characters are in the name.
     NEO4J_DATABASE_QUOTED = f"`{NEO4J_DATABASE}`"
 
+    if use_bolt():
+        with open(os.path.join(NEO4J_IMPORT, "indices.cypher")) as f:
+            cyphers = [cypher.strip() for cypher in f.read().split(";") if cypher.strip() != ""]
+        try:
+            execute_cypher(cyphers, NEO4J_DATABASE, verbose=verbose)
+            # wait until the indices are populated
+            execute_cypher([f"CALL db.awaitIndexes({INDEX_TIMEOUT})"], NEO4J_DATABASE, verbose=verbose)
+        except Exception:
+            print("ERROR: add_indices: adding indices and constraints failed.", flush=True)
+            raise
+        return
+
     # compose the cypher shell command
     cypher_shell = quote_path(os.path.join(NEO4J_BIN, "cypher-shell"))
     cypher_script = quote_path(os.path.join(NEO4J_IMPORT, "indices.cypher"))
@@ -278,6 +366,14 @@ def run_cypher(mode, verbose=False):
             cypher = cypher.replace(NEO4J_DATABASE, NEO4J_DATABASE_QUOTED)
             cyphers.append(f"{cypher};")
 
+    if use_bolt():
+        try:
+            execute_cypher(cyphers, "system", verbose=verbose)
+        except Exception:
+            print(f"ERROR: run_cypher: {NEO4J_CYPHER} statements failed.", flush=True)
+            raise
+        return
+
     # compose the cypher shell command
     cypher_shell = quote_path(os.path.join(NEO4J_BIN, "cypher-shell"))
     for cypher in cyphers:
@@ -292,3 +388,65 @@ def run_cypher(mode, verbose=False):
             print(f"ERROR: run_cypher: {cypher} statement failed.", flush=True)
             print(e.output)
             raise
+
+
+def use_bolt():
+    # Admin and index Cypher statements are run with cypher-shell (default) or through a Bolt connection
+    # if NEO4J_CYPHER_BACKEND=bolt. The Bolt backend avoids starting a cypher-shell JVM for each command.
+    return os.getenv("NEO4J_CYPHER_BACKEND", "cypher-shell").lower() == "bolt"
+
+
+def get_graph(database):
+    """
+    Return a py2neo Graph for `database`. The connections are pooled and reused across calls.
+    The server is set by the NEO4J_URI environment variable (default: bolt://localhost:7687).
+    """
+    from py2neo import Graph
+
+    if database not in _graphs:
+        NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+        NEO4J_USERNAME = os.getenv("NEO4J_USERNAME")
+        NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
+        _graphs[database] = Graph(NEO4J_URI, name=database, user=NEO4J_USERNAME, password=NEO4J_PASSWORD)
+    return _graphs[database]
+
+
+def execute_cypher(cyphers, database, verbose=False):
+    """
+    Run Cypher statements one at a time on `database` through the Bolt backend and report the time of each statement.
+
+    Returns
+    -------
+    list: (statement, seconds) for each statement.
+    """
+    graph = get_graph(database)
+    timings = []
+    for cypher in cyphers:
+        cypher = cypher.strip().rstrip(";")
+        start = time.perf_counter()
+        try:
+            cursor = graph.run(cypher)
+            if verbose:
+                print(cursor.data(), flush=True)
+            else:
+                cursor.stats()
+        except Exception as e:
+            print(f"ERROR: execute_cypher: {cypher} statement failed on database: {database}: {e}", flush=True)
+            raise
+        elapsed = time.perf_counter() - start
+        timings.append((cypher, elapsed))
+        print(f"{elapsed:8.2f} s  {database}: {cypher}", flush=True)
+    return timings
+
+
+def wait_for_database(database, timeout=INDEX_TIMEOUT):
+    # Wait until a newly created database is online
+    graph = get_graph("system")
+    deadline = time.monotonic() + timeout
+    while True:
+        status = graph.run("SHOW DATABASE $name YIELD currentStatus", name=database).evaluate()
+        if status == "online":
+            return
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Database {database} is not online after {timeout} s, status: {status}")
+        time.sleep(0.5)
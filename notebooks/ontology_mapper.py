@@ -5,15 +5,39 @@ Author: Peter W Rose (pwrose@ucsd.edu)
 Created: 2024-03-03
 """
 import os
+import functools
+import gzip
+import json
+import re
+import threading
 import requests
 from dotenv import load_dotenv
 import time
 import pandas as pd
 import inflection
+from concurrent.futures import ThreadPoolExecutor
+
+import http_utils
 
 CHUNK_SIZE = 50
 
-def map_ontology(df, input_col, output_col, ontology, apikey):
+# BioPortal recommender endpoint, can be pointed to a local stand-in server for testing
+RECOMMENDER_URL = os.getenv("BIOPORTAL_RECOMMENDER_URL", "https://data.bioontology.org/recommender")
+
+# Term normalization rules
+RULES_PATH = os.getenv("ONTOLOGY_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ontology_rules.csv"))
+
+# Persistent cache of the recommender results per term
+TERM_CACHE_PATH = os.getenv("ONTOLOGY_CACHE_PATH", "../data/ontology_cache.json")
+TERM_CACHE_TTL = float(os.getenv("ONTOLOGY_CACHE_TTL", 30 * 24 * 3600))  # seconds
+TERM_CACHE_VERSION = 1  # increment when the cached results change meaning, older caches are discarded
+
+_term_caches = {}
+_ontology_indexes = {}
+_normalization_rules = {}
+
+
+def map_ontology(df, input_col, output_col, ontology, apikey, use_cache=True, max_workers=4, rate_limit=2, ontology_files=None):
     """
     Map terms from a DataFrame column to concepts in an ontology.
 
@@ -23,6 +47,14 @@ def map_ontology(df, input_col, output_col, ontology, apikey):
     input_col (str): The name of the column in `df` containing terms to be mapped.
     output_col (str): The name of the column in `df` to store the mapped ontology concepts.
     ontology (Ontology): Name of the ontology
+    use_cache (bool): If True, look up terms in the persistent term cache first (see TermCache)
+        and only send the missing terms to BioPortal.
+    max_workers (int): Number of concurrent requests to BioPortal.
+    rate_limit (float): Maximum number of requests per second to BioPortal.
+    ontology_files (list): Local OBO files, e.g. ["../data/uberon-basic.obo", "../data/cl-basic.obo"].
+        Terms that exactly match a class name or exact synonym in these files are mapped
+        offline and only the remaining terms are sent to BioPortal. Defaults to the
+        comma-separated list in the ONTOLOGY_FILES_<ontology> environment variable, e.g. ONTOLOGY_FILES_UBERON.
 
     Returns
     -------
@@ -55,59 +87,35 @@ def map_ontology(df, input_col, output_col, ontology, apikey):
     
     """
 
-    # convert to lowercase and map to ontology
-    df["__lower__"] = df[input_col].str.lower()
+    cache = get_term_cache() if use_cache else None
 
-    # remove misc characters that interfere with ontology matching
-    df["__lower__"] = df["__lower__"].str.replace("-", " ")
-    df["__lower__"] = df["__lower__"].str.replace(r'\(.*?\)', '', regex=True)
+    if ontology_files is None:
+        ontology_files = [f for f in os.getenv(f"ONTOLOGY_FILES_{ontology}", "").split(",") if f.strip()]
+    index = get_ontology_index(ontology_files) if ontology_files else None
+
+    # normalize terms with the rules in the rule table (see ontology_rules.csv)
+    rules = get_normalization_rules()
+
+    # convert to lowercase and remove misc characters that interfere with ontology matching
+    df["__lower__"] = apply_rules(df[input_col].str.lower(), rules, ontology, "clean")
 
     # cleanup special cases from GeneLab
-    if ontology == "UBERON":
-        df["__lower__"] = df["__lower__"].str.replace("human", "")
-        df["__lower__"] = df["__lower__"].str.replace("murine", "")
-        df["__lower__"] = df["__lower__"].str.replace("male", "")
-        df["__lower__"] = df["__lower__"].str.replace("female", "")
-        df["__lower__"] = df["__lower__"].str.replace("carcass", "")
-        df["__lower__"] = df["__lower__"].str.replace("tissue", "")
-        df["__lower__"] = df["__lower__"].str.replace("mandibular bone", "mandible")
-        df["__lower__"] = df["__lower__"].str.replace("left lobe of the liver", "liver left lateral lobe")
-
-    df["__lower__"] = df["__lower__"].str.strip()
-    
-    df = map_column_new(df, "__lower__", ontology, apikey)
+    df["__lower__"] = apply_rules(df["__lower__"], rules, ontology, "lower").str.strip()
 
     # remove anatomical positions and other prefixes to match UEBERON ontology classes
-    df["__nopos__"] = df["__lower__"]
-    if ontology == "UBERON":
-        df["__nopos__"] = df["__nopos__"].str.replace("left" , "")
-        df["__nopos__"] = df["__nopos__"].str.replace("right", "")
-        df["__nopos__"] = df["__nopos__"].str.replace("both sides", "")
-        df["__nopos__"] = df["__nopos__"].str.replace("medial", "")
-        df["__nopos__"] = df["__nopos__"].str.replace("distal", "")
-        df["__nopos__"] = df["__nopos__"].str.replace("peripheral", "")
-        df["__nopos__"] = df["__nopos__"].str.replace("dorsal", "")
-        df["__nopos__"] = df["__nopos__"].str.replace("lateral", "")
-        df["__nopos__"] = df["__nopos__"].str.replace("4th", "")
-        df["__nopos__"] = df["__nopos__"].str.replace("femoral", "")
-        df["__nopos__"] = df["__nopos__"].str.replace("ventricular", "")
-        df["__nopos__"] = df["__nopos__"].str.replace("primary", "")
-        df["__nopos__"] = df["__nopos__"].str.replace("partial", "")
-        df["__nopos__"] = df["__nopos__"].str.replace("whole", "")
-        df["__nopos__"] = df["__nopos__"].str.replace("lobe of the", "lobe of")
-        df["__nopos__"] = df["__nopos__"].str.replace("3d", "") # 3d cells
-
-
-    df["__nopos__"] = df["__nopos__"].str.strip()
-    #print(df[["__nopos__"]].head())
-    df = map_column_new(df, "__nopos__", ontology, apikey)
-
-    # convert plural to singular terms and map to ontology
-    df["__nopos__singular__"] = df["__nopos__"].apply(lambda x: inflection.singularize(x))
-    df = map_column_new(df, "__nopos__singular__", ontology, apikey)
-    
-    df["__singular__"] = df["__lower__"].apply(lambda x: inflection.singularize(x))
-    df = map_column_new(df, "__singular__", ontology, apikey)
+    df["__nopos__"] = apply_rules(df["__lower__"], rules, ontology, "nopos").str.strip()
+
+    # convert plural to singular terms
+    df["__nopos__singular__"] = map_unique(df["__nopos__"], singularize)
+    df["__singular__"] = map_unique(df["__lower__"], singularize)
+
+    # map the unique terms of all variants to the ontology at once
+    columns = ["__lower__", "__nopos__", "__nopos__singular__", "__singular__"]
+    terms = pd.unique(df[columns].to_numpy().ravel())
+    matches = lookup_terms(terms, ontology, apikey, cache, max_workers=max_workers, rate_limit=rate_limit, index=index)
+
+    for column in columns:
+        df = df.merge(matches_to_frame(matches, column), on=column, how="left")
 
 
     # Create output columns
@@ -142,22 +150,323 @@ def map_ontology(df, input_col, output_col, ontology, apikey):
 #     return df
 
 
-def map_column_new(df, column, ontology, apikey):
+def get_normalization_rules(path=None):
+    """
+    Return the term normalization rules compiled to one regular expression per ontology and stage.
+
+    The rules are read from a CSV file with the columns ontology, stage, pattern, replacement,
+    and regex (default: the ONTOLOGY_RULES_PATH environment variable or ontology_rules.csv next
+    to this module). Rules for the ontology "*" apply to all ontologies. Patterns are literal
+    strings unless regex is true. Replacements are literal strings. The rules of a stage are
+    applied in a single pass: the text is scanned from left to right and at each position the
+    first listed matching pattern is replaced, so list longer patterns first (e.g. "female" before "male").
+
+    Returns
+    -------
+    dict: {(ontology, stage): (compiled regex, list of replacements)}
+    """
+    path = path or RULES_PATH
+    if path not in _normalization_rules:
+        rules = pd.read_csv(path, dtype=str, keep_default_na=False)
+        compiled = {}
+        for (ontology, stage), group in rules.groupby(["ontology", "stage"], sort=False):
+            patterns = []
+            for i, (pattern, regex) in enumerate(zip(group["pattern"], group["regex"])):
+                pattern = pattern if regex.strip().lower() == "true" else re.escape(pattern)
+                patterns.append(f"(?P<r{i}>{pattern})")
+            compiled[(ontology, stage)] = (re.compile("|".join(patterns)), list(group["replacement"]))
+        _normalization_rules[path] = compiled
+    return _normalization_rules[path]
+
+
+def apply_rules(series, rules, ontology, stage):
+    """
+    Apply the rules of the given stage for all ontologies ("*") and then for `ontology` to a Series of terms.
+    """
+    for key in [("*", stage), (ontology, stage)]:
+        if key in rules:
+            pattern, replacements = rules[key]
+            replace = lambda match: replacements[int(match.lastgroup[1:])]
+            series = map_unique(series, lambda term: pattern.sub(replace, term))
+    return series
+
+
+def map_unique(series, func):
+    """
+    Apply `func` to each unique string in `series`. Other values are kept as is.
+    """
+    mapping = {value: func(value) for value in series.unique() if isinstance(value, str)}
+    return series.map(mapping).where(series.isin(list(mapping)), series)
+
+
+@functools.lru_cache(maxsize=None)
+def singularize(term):
+    return inflection.singularize(term)
+
+
+def map_column_new(df, column, ontology, apikey, cache=None):
     terms = list(df[column].unique())
+    matches = lookup_terms(terms, ontology, apikey, cache)
+    df = df.merge(matches_to_frame(matches, column), on=column, how="left")
+    return df
+
+
+def lookup_terms(terms, ontology, apikey, cache=None, max_workers=1, rate_limit=None, index=None):
+    """
+    Map terms to ontology classes with a local ontology index and the BioPortal recommender.
+
+    Parameters
+    ----------
+    terms (list): Unique terms to map.
+    ontology (str): Name of the ontology.
+    apikey (str): BioPortal API key.
+    cache (TermCache): If given, only the terms missing from the cache are sent to BioPortal
+        and the results are added to the cache.
+    max_workers (int): Number of concurrent requests.
+    rate_limit (float): Maximum number of requests per second. If None, each request
+        waits 0.5 s as before.
+    index (OntologyIndex): If given, terms found in the index are mapped offline.
+
+    Returns
+    -------
+    dict: {term: [[id, name], ...]}, with an empty list for terms without a match.
+    """
+    terms = [term for term in terms if isinstance(term, str)]
+
+    # Map exact name and synonym matches offline
+    results = {}
+    if index is not None:
+        results = {term: index.lookup(term) for term in terms}
+        terms = [term for term, matches in results.items() if not matches]
+
+    # Only send terms to BioPortal that are not in the cache
+    if cache is not None:
+        cached = {term: cache.get(term, ontology) for term in terms}
+        results.update(cached)
+        terms = [term for term, matches in cached.items() if matches is None]
 
     # BioPortal recommender can only handle a small number of terms at a time. 
     # Run it in small chunks
     chunks = create_chunks(terms, CHUNK_SIZE)
+    if len(chunks) == 0:
+        return results
 
-    dfs = []
-    for chunk in chunks:
-        mapped_terms = match_terms(chunk, column, ontology, apikey)
-        dfs.append(mapped_terms)
+    session = http_utils.create_session(pool_size=max_workers)
+    limiter = http_utils.RateLimiter(rate_limit) if rate_limit else None
 
-    mapped_df = pd.concat(dfs)
-    
-    df = df.merge(mapped_df, on=column, how="left")
-    return df
+    def match_chunk(chunk):
+        mapped_terms = match_terms(chunk, "__term__", ontology, apikey, session=session, limiter=limiter)
+        return group_matches(chunk, mapped_terms)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for chunk_results in executor.map(match_chunk, chunks):
+                results.update(chunk_results)
+                if cache is not None:
+                    cache.update(chunk_results, ontology)
+    finally:
+        # keep the results of the completed chunks if a request fails
+        if cache is not None:
+            cache.save()
+
+    return results
+
+
+def matches_to_frame(matches, column):
+    """
+    Convert the results of lookup_terms() to a DataFrame with the columns
+    `column`, "__id<column>" and "__name<column>", one row per match.
+    """
+    rows = [(term, concept_id, name) for term, term_matches in matches.items() if term_matches for concept_id, name in term_matches]
+    return pd.DataFrame(rows, columns=[column, f"__id{column}", f"__name{column}"])
+
+
+def group_matches(terms, mapped_terms):
+    """
+    Group the results of match_terms() by term: {term: [[id, name], ...]}.
+    Terms without a match get an empty list.
+    """
+    label = mapped_terms.columns[0]
+    matches = {term: [] for term in terms}
+    for term, concept_id, name in mapped_terms[[label, f"__id{label}", f"__name{label}"]].itertuples(index=False):
+        if term in matches and [concept_id, name] not in matches[term]:
+            matches[term].append([concept_id, name])
+    return matches
+
+
+def get_ontology_index(paths):
+    """
+    Return the OntologyIndex for the given OBO files. The index is built once per process.
+    """
+    key = tuple(paths)
+    if key not in _ontology_indexes:
+        _ontology_indexes[key] = OntologyIndex(paths)
+    return _ontology_indexes[key]
+
+
+class OntologyIndex:
+    """
+    Offline index of the class names and exact synonyms of ontologies in OBO format.
+
+    Labels are normalized (lowercase, single spaces) and stored in a hash map, so
+    a term is matched with a single dictionary lookup. Class names take precedence
+    over exact synonyms. Obsolete classes are skipped. Matches have the same
+    [uri, name] format as the BioPortal results, where name is the matched term.
+
+    Parameters
+    ----------
+    paths : list
+        OBO files (.obo or .obo.gz). OWL files are not supported, convert them to OBO
+        first, e.g. with ROBOT: robot convert --input uberon.owl --output uberon.obo
+
+    Example
+    -------
+    >>> index = OntologyIndex(["../data/uberon-basic.obo"])
+    >>> index.lookup("liver")
+    [['http://purl.obolibrary.org/obo/UBERON_0002107', 'liver']]
+    """
+
+    URI_PREFIX = "http://purl.obolibrary.org/obo/"
+    SYNONYM = re.compile(r'^synonym:\s*"((?:[^"\\]|\\.)*)"\s+EXACT')
+
+    def __init__(self, paths):
+        self.names = {}
+        self.synonyms = {}
+        for path in paths:
+            self._load(path)
+
+    def lookup(self, term):
+        """
+        Return the list of [uri, name] pairs of the classes with the name or exact synonym `term`.
+        """
+        key = self.normalize(term)
+        uris = self.names.get(key) or self.synonyms.get(key) or []
+        return [[uri, term] for uri in uris]
+
+    @staticmethod
+    def normalize(label):
+        return " ".join(label.lower().split())
+
+    def _load(self, path):
+        if not path.endswith((".obo", ".obo.gz")):
+            raise ValueError(f"Unsupported ontology file {path!r}, only OBO files (.obo, .obo.gz) are supported")
+
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            stanza = None
+            for line in f:
+                line = line.strip()
+                if line.startswith("["):
+                    self._add(stanza)
+                    stanza = {"synonyms": []} if line == "[Term]" else None
+                elif stanza is None:
+                    continue
+                elif line.startswith("id:"):
+                    stanza["id"] = line[3:].strip()
+                elif line.startswith("name:"):
+                    stanza["name"] = line[5:].strip()
+                elif line.startswith("synonym:"):
+                    match = self.SYNONYM.match(line)
+                    if match:
+                        stanza["synonyms"].append(match.group(1).replace('\\"', '"'))
+                elif line == "is_obsolete: true":
+                    stanza["obsolete"] = True
+            self._add(stanza)
+
+    def _add(self, stanza):
+        if not stanza or stanza.get("obsolete") or ":" not in stanza.get("id", ""):
+            return
+
+        uri = self.URI_PREFIX + stanza["id"].replace(":", "_")
+        labels = [(self.names, stanza.get("name", ""))] + [(self.synonyms, synonym) for synonym in stanza["synonyms"]]
+        for labels_index, label in labels:
+            key = self.normalize(label)
+            if key and uri not in labels_index.setdefault(key, []):
+                labels_index[key].append(uri)
+
+
+def get_term_cache(path=None):
+    """
+    Return the term cache stored at `path` (default: the ONTOLOGY_CACHE_PATH environment
+    variable or ../data/ontology_cache.json). The cache is loaded once per process.
+    """
+    path = path or TERM_CACHE_PATH
+    if path not in _term_caches:
+        _term_caches[path] = TermCache(path)
+    return _term_caches[path]
+
+
+class TermCache:
+    """
+    Persistent cache of BioPortal recommender results keyed by (normalized term, ontology).
+
+    For each term, the cache stores the ontology classes whose annotation covers the
+    whole term, or an empty list if the term could not be mapped (negative result).
+    Entries expire after `ttl` seconds. The cache file records a format version, and
+    a cache written with a different version is discarded.
+
+    Parameters
+    ----------
+    path : str
+        JSON file where the cache is stored.
+    ttl : float
+        Time-to-live of an entry in seconds.
+    """
+
+    def __init__(self, path, ttl=TERM_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                if data.get("version") == TERM_CACHE_VERSION:
+                    self.entries = data.get("entries", {})
+            except (OSError, ValueError):
+                print(f"Warning: could not read ontology cache {path!r}, starting with an empty cache")
+
+    def get(self, term, ontology):
+        """
+        Return the list of [id, name] pairs for `term`, or None if it is not cached or has expired.
+        """
+        if not isinstance(term, str):
+            return None
+        with self.lock:
+            entry = self.entries.get(self._key(term, ontology))
+        if entry is None or time.time() - entry["fetched"] > self.ttl:
+            return None
+        return entry["matches"]
+
+    def update(self, matches, ontology):
+        """
+        Store the results {term: [[id, name], ...]} of group_matches(), including the terms without a match.
+        """
+        now = time.time()
+        with self.lock:
+            for term, term_matches in matches.items():
+                self.entries[self._key(term, ontology)] = {"matches": term_matches, "fetched": now}
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            temp_path = f"{self.path}.part"
+            with open(temp_path, "w") as f:
+                json.dump({"version": TERM_CACHE_VERSION, "entries": self.entries}, f)
+            os.replace(temp_path, self.path)
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+        self.save()
+
+    @staticmethod
+    def _key(term, ontology):
+        return f"{ontology}\t{term}"
 
 
 def create_chunks(data, chunk_size):
@@ -181,8 +490,8 @@ def create_chunks(data, chunk_size):
     return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
     
 
-def match_terms(terms, label, ontology, apikey):
-    data = get_recommendation(terms, ontology, apikey)
+def match_terms(terms, label, ontology, apikey, session=None, limiter=None):
+    data = get_recommendation(terms, ontology, apikey, session=session, limiter=limiter)
     id_col = f"__id{label}"
     name_col = f"__name{label}"
     
@@ -199,7 +508,7 @@ def match_terms(terms, label, ontology, apikey):
     return match
 
 
-def get_recommendation(terms, ontologies, apikey):
+def get_recommendation(terms, ontologies, apikey, session=None, limiter=None):
     """
     Get ontology recommendations based on input terms.
 
@@ -213,6 +522,10 @@ def get_recommendation(terms, ontologies, apikey):
         Can be a single ontology or a list of ontologies separated by comma.
     apikey : str
         BipPortal API key.
+    session : requests.Session, optional
+        Session used for the request, e.g. created with http_utils.create_session().
+    limiter : http_utils.RateLimiter, optional
+        Rate limiter shared by concurrent requests. If None, the request waits 0.5 s.
 
     Returns
     -------
@@ -243,16 +556,19 @@ def get_recommendation(terms, ontologies, apikey):
     >>> ontologies = "FOODON"
     >>> recommendations = get_recommendation(terms, ontologies, APIKEY)
     """
-    time.sleep(0.5)
+    if limiter is None:
+        time.sleep(0.5)
+    else:
+        limiter.acquire()
     
-    URL = "https://data.bioontology.org/recommender"
+    URL = RECOMMENDER_URL
     HEADERS = {"accept": "application/json", "Authorization": f"apikey token={apikey}"}
     terms_string = ",".join(terms)
 
     params = {"input": terms_string, "input_type": "2", "ontologies": ontologies}
 
     try:
-        response = requests.post(URL, headers=HEADERS, json=params)
+        response = (session or requests).post(URL, headers=HEADERS, json=params)
         response.raise_for_status()
         data = response.json()
     except requests.exceptions.HTTPError as error:
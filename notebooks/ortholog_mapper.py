@@ -5,9 +5,33 @@ Author: Peter W Rose (pwrose@ucsd.edu)
 Created: 2024-03-05
 """
 
+import argparse
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+
+import numpy as np
 import pandas as pd
 
-def map_orthologs(df, ortholog_species_col, ortholog_species_entrez_gene_col, human_entrez_gene_col, ortholog_dbs):
+JAX_URL = "https://www.informatics.jax.org/downloads/reports/HOM_AllOrganism.rpt"
+HCOP_URL = "https://ftp.ebi.ac.uk/pub/databases/genenames/hcop/human_all_hcop_sixteen_column.txt.gz"
+
+# Local mapping store, built once from the JAX and HCOP downloads (see refresh_ortholog_store)
+ORTHOLOG_STORE_PATH = os.getenv("ORTHOLOG_STORE_PATH", "../data/orthologs")
+STORE_KEYS = ["ortholog_species", "ortholog_species_entrez_gene"]
+STORE_FORMAT = 2  # increment when the layout of the store changes, older versions are rebuilt
+
+# Bit positions of the databases in the "support" bitmask of the HCOP mappings. Do not reorder.
+SUPPORT_DBS = ["Ensembl", "Treefam", "OMA", "EggNOG", "PhylomeDB", "OrthoDB", "Panther", "NCBI",
+               "HomoloGene", "Inparanoid", "OrthoMCL", "HGNC", "ZFIN", "PomBase", "JAX"]
+
+_store_tables = {}
+_store_lock = threading.RLock()
+
+
+def map_orthologs(df, ortholog_species_col, ortholog_species_entrez_gene_col, human_entrez_gene_col, ortholog_dbs, integer_keys=False):
     """
     Maps orthologous genes from other species to human genes.
 
@@ -29,6 +53,11 @@ def map_orthologs(df, ortholog_species_col, ortholog_species_entrez_gene_col, hu
         List of ortholog databases to use for mapping.
         See get_ortholog_dbs() for a list of available databases.
 
+    integer_keys : bool
+        If True, the species and Entrez gene IDs are converted to a single integer key and
+        joined against a cached index of the mappings. This is much faster for large tables.
+        Rows with IDs that are not integers are not mapped.
+
     Returns:
     --------
     pandas.DataFrame
@@ -65,20 +94,25 @@ def map_orthologs(df, ortholog_species_col, ortholog_species_entrez_gene_col, hu
     # check if ortholog species mappings are available in the specified databases
     check_ortholog_species(df, ortholog_species_col, ortholog_dbs)
 
-    mappings = get_ortholog_mappings(ortholog_dbs)
-
     # TODO check if organisms are supported
 
-    mappings.rename(columns={"ortholog_species": ortholog_species_col, "ortholog_species_entrez_gene": ortholog_species_entrez_gene_col, "human_entrez_gene": human_entrez_gene_col}, inplace=True)
-
     # drop the output column if it exists
     df.drop(columns=human_entrez_gene_col, errors="ignore", inplace=True)
 
     # map orthologs
-    df = df.merge(mappings, on=[ortholog_species_col, ortholog_species_entrez_gene_col], how="left")
+    if integer_keys:
+        mappings = get_ortholog_index(ortholog_dbs).rename(columns={"human_entrez_gene": human_entrez_gene_col})
+        df = df.assign(_ortholog_key=ortholog_key(df[ortholog_species_col], df[ortholog_species_entrez_gene_col]))
+        df = df.merge(mappings, left_on="_ortholog_key", right_index=True, how="left")
+        df = df.drop(columns="_ortholog_key").reset_index(drop=True)
+    else:
+        mappings = get_ortholog_mappings(ortholog_dbs)
+        mappings.rename(columns={"ortholog_species": ortholog_species_col, "ortholog_species_entrez_gene": ortholog_species_entrez_gene_col, "human_entrez_gene": human_entrez_gene_col}, inplace=True)
+        df = df.merge(mappings, on=[ortholog_species_col, ortholog_species_entrez_gene_col], how="left")
 
     # human genes don"t need to be mapped
-    df[human_entrez_gene_col] = df.apply(lambda x: x[ortholog_species_entrez_gene_col] if x[ortholog_species_col] == "9606" else x[human_entrez_gene_col], axis=1)
+    human = df[ortholog_species_col] == "9606"
+    df[human_entrez_gene_col] = df[human_entrez_gene_col].where(~human, df[ortholog_species_entrez_gene_col])
 
     #df.fillna("", inplace=True) # this modifies the passed-in dataframe
     #df[human_entrez_gene_col].fillna("", inplace=True)
@@ -87,6 +121,42 @@ def map_orthologs(df, ortholog_species_col, ortholog_species_entrez_gene_col, hu
     return df
 
 
+def ortholog_key(species, entrez_gene):
+    """
+    Combine NCBI taxonomy IDs and Entrez gene IDs into int64 keys (taxonomy ID in the upper 32 bits).
+    IDs that are not integers get the key -1.
+    """
+    species = _to_number(species)
+    entrez_gene = _to_number(entrez_gene)
+    valid = ~np.isnan(species) & ~np.isnan(entrez_gene) & (entrez_gene < 2**32)
+    key = np.where(valid, species, 0).astype("int64") * 2**32 + np.where(valid, entrez_gene, 0).astype("int64")
+    return np.where(valid, key, -1)
+
+
+def _to_number(values):
+    # Parse the unique values only, there are far fewer of them than rows
+    codes, uniques = pd.factorize(values)
+    numbers = pd.to_numeric(pd.Series(uniques, dtype=object), errors="coerce").to_numpy(dtype="float64")
+    numbers = np.append(numbers, np.nan)  # code -1 (missing value)
+    return numbers[codes]
+
+
+def get_ortholog_index(ortholog_dbs):
+    """
+    Return the mappings for the given databases indexed by ortholog_key(), with a "human_entrez_gene" column.
+    The index is built once per store version and combination of databases.
+    """
+    with _store_lock:
+        version_path = get_ortholog_store_version() or refresh_ortholog_store()
+        key = (version_path, "index", tuple(sorted(ortholog_dbs)))
+        if key not in _store_tables:
+            mappings = get_ortholog_mappings(ortholog_dbs)
+            index = ortholog_key(mappings["ortholog_species"], mappings["ortholog_species_entrez_gene"])
+            mappings = pd.DataFrame({"human_entrez_gene": mappings["human_entrez_gene"].to_numpy()}, index=index)
+            _store_tables[key] = mappings[mappings.index >= 0].sort_index(kind="stable")
+        return _store_tables[key]
+
+
 def get_ortholog_mappings(ortholog_dbs):
     # get JAX vertebrate mappings (mouse, human, rat, zebrafish)       
     jax = pd.DataFrame()
@@ -183,8 +253,145 @@ def get_ortholog_species():
     return ortholog_list
 
 def get_jax_mappings():
+    return load_ortholog_store("jax")
+
+
+def get_hgnc_mappings(ortholog_dbs):
+    df = load_ortholog_store("hcop")
+
+    # filter mappings by the list of provided ortholog databases
+    df = df[(df["support"] & support_mask(ortholog_dbs)) != 0]
+
+    # reorder columns
+    df = df[["ortholog_species", "ortholog_species_entrez_gene", "human_entrez_gene"]]
+    return df
+
+
+def load_ortholog_store(name, store_path=None):
+    """
+    Load a table of the local ortholog mapping store.
+
+    The tables are read once per process and then served from memory. If the store
+    does not exist yet, it is built with refresh_ortholog_store().
+
+    Parameters
+    ----------
+    name : str
+        "jax" for the JAX mappings or "hcop" for the HCOP mappings with their "support" column.
+    store_path : str
+        Directory of the store. Defaults to the ORTHOLOG_STORE_PATH environment variable or ../data/orthologs.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A copy of the table, sorted by ortholog species and ortholog species Entrez gene ID.
+    """
+    store_path = store_path or ORTHOLOG_STORE_PATH
+    with _store_lock:
+        version_path = get_ortholog_store_version(store_path)
+        if version_path is None:
+            print(f"Ortholog store not found in {store_path}, building it from the JAX and HCOP downloads")
+            version_path = refresh_ortholog_store(store_path)
+
+        key = (version_path, name)
+        if key not in _store_tables:
+            _store_tables[key] = pd.read_parquet(os.path.join(version_path, f"{name}.parquet"))
+        df = _store_tables[key]
+
+    return df.copy()
+
+
+def get_ortholog_store_version(store_path=None):
+    """
+    Return the directory of the current version of the ortholog store, or None if the store has not been built.
+    """
+    store_path = store_path or ORTHOLOG_STORE_PATH
+    current_file = os.path.join(store_path, "CURRENT")
+    if not os.path.exists(current_file):
+        return None
+
+    with open(current_file) as f:
+        version_path = os.path.join(store_path, f.read().strip())
+    manifest_file = os.path.join(version_path, "manifest.json")
+    if not os.path.exists(manifest_file):
+        return None
+
+    with open(manifest_file) as f:
+        if json.load(f).get("format") != STORE_FORMAT:
+            return None
+    return version_path
+
+
+def refresh_ortholog_store(store_path=None, keep=2):
+    """
+    Download the JAX and HCOP ortholog files and build a new version of the local ortholog store.
+
+    Each version is a subdirectory named by its build time with a "jax.parquet" and a
+    "hcop.parquet" table sorted by (ortholog_species, ortholog_species_entrez_gene) and a
+    "manifest.json" with the source URLs and row counts. The "CURRENT" file points to the
+    version in use and is only switched after the new version has been completely written.
+
+    Parameters
+    ----------
+    store_path : str
+        Directory of the store. Defaults to the ORTHOLOG_STORE_PATH environment variable or ../data/orthologs.
+    keep : int
+        Number of versions to keep, including the new one.
+
+    Returns
+    -------
+    str
+        Directory of the new version.
+
+    Example
+    -------
+    From the command line:
+
+    $ python ortholog_mapper.py refresh
+    """
+    store_path = store_path or ORTHOLOG_STORE_PATH
+    version = datetime.now().strftime("%Y%m%d%H%M%S")
+    version_path = os.path.join(store_path, version)
+    temp_path = f"{version_path}.part"
+    os.makedirs(temp_path, exist_ok=True)
+
+    tables = {"jax": download_jax_mappings(), "hcop": download_hgnc_mappings()}
+    for name, df in tables.items():
+        df = df.sort_values(STORE_KEYS, kind="stable", ignore_index=True)
+        df.to_parquet(os.path.join(temp_path, f"{name}.parquet"), index=False, row_group_size=100_000)
+
+    manifest = {
+        "version": version,
+        "format": STORE_FORMAT,
+        "support_dbs": SUPPORT_DBS,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "sources": {"jax": JAX_URL, "hcop": HCOP_URL},
+        "rows": {name: len(df) for name, df in tables.items()},
+    }
+    with open(os.path.join(temp_path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, version_path)
+
+    # Switch to the new version
+    with open(os.path.join(store_path, "CURRENT.part"), "w") as f:
+        f.write(version)
+    os.replace(os.path.join(store_path, "CURRENT.part"), os.path.join(store_path, "CURRENT"))
+
+    # Remove old versions
+    versions = sorted(d for d in os.listdir(store_path) if d.isdigit() and os.path.isdir(os.path.join(store_path, d)))
+    for old_version in versions[: -max(keep, 1)]:
+        shutil.rmtree(os.path.join(store_path, old_version), ignore_errors=True)
+
+    with _store_lock:
+        _store_tables.clear()
+
+    print(f"Ortholog store version {version}: {manifest['rows']['jax']} JAX and {manifest['rows']['hcop']} HCOP mappings")
+    return version_path
+
+
+def download_jax_mappings():
     columns = ["DB Class Key", "NCBI Taxon ID", "EntrezGene ID"]
-    df = pd.read_csv("https://www.informatics.jax.org/downloads/reports/HOM_AllOrganism.rpt", usecols=columns, dtype=str, sep="\t")
+    df = pd.read_csv(JAX_URL, usecols=columns, dtype=str, sep="\t")
 
     # create a dataframe with human genes
     df_human = df[df["NCBI Taxon ID"] == "9606"].copy()
@@ -203,25 +410,60 @@ def get_jax_mappings():
     return df
 
 
-def get_hgnc_mappings(ortholog_dbs):
+def download_hgnc_mappings(chunksize=500_000):
+    """
+    Download the HCOP mappings with the supporting databases of each mapping encoded
+    as a bitmask (see SUPPORT_DBS and support_mask()).
+
+    The file is read in chunks, so the comma-separated "support" lists are never
+    exploded into one row per database.
+    """
     columns = ["ortholog_species", "ortholog_species_entrez_gene", "human_entrez_gene", "support"]
-    df = pd.read_csv("https://ftp.ebi.ac.uk/pub/databases/genenames/hcop/human_all_hcop_sixteen_column.txt.gz", dtype=str, usecols=columns, sep="\t")
+    keys = ["ortholog_species", "ortholog_species_entrez_gene", "human_entrez_gene"]
 
-    # filter mappings by the list of provided ortholog databases
-    df["support"] = df["support"].str.split(",")
-    df = df.explode("support")
-    df = df[df["support"].isin(ortholog_dbs)]
-    df.drop(columns=["support"], inplace=True)
-    df.drop_duplicates(inplace=True)
+    chunks = []
+    for df in pd.read_csv(HCOP_URL, dtype=str, usecols=columns, sep="\t", chunksize=chunksize):
+        # remove rows that don"t have entrez gene identifiers
+        df = df[(df["ortholog_species_entrez_gene"].str.isdigit()) & (df["human_entrez_gene"].str.isdigit())]
 
-    # remove rows that don"t have entrez gene identifiers
-    df = df[(df["ortholog_species_entrez_gene"].str.isdigit()) & (df["human_entrez_gene"].str.isdigit())].copy()
+        # encode the supporting databases and keep rows supported by at least one known database
+        bits = support_bits(df["support"])
+        df = df[keys].assign(support=bits)
+        chunks.append(df[bits != 0])
+
+    df = pd.concat(chunks, ignore_index=True)
+
+    # combine the supporting databases of duplicate mappings, keeping the order of the first occurrence
+    groups = df.groupby(keys, sort=False).ngroup().to_numpy()
+    support = np.zeros(groups.max() + 1 if len(df) > 0 else 0, dtype="int32")
+    np.bitwise_or.at(support, groups, df["support"].to_numpy())
+    df = df.drop_duplicates(keys, ignore_index=True).assign(support=support)
 
-    # reorder columns
-    df = df[["ortholog_species", "ortholog_species_entrez_gene", "human_entrez_gene"]]
     return df
 
 
+def support_bits(support):
+    """
+    Encode comma-separated lists of ortholog databases as bitmasks (bit i for SUPPORT_DBS[i]).
+    Unknown databases are ignored.
+    """
+    # Parse the unique lists only, there are far fewer of them than rows
+    codes, uniques = pd.factorize(support)
+    bits = np.array([support_mask(str(value).split(",")) for value in uniques] + [0], dtype="int32")
+    return bits[codes]
+
+
+def support_mask(ortholog_dbs):
+    """
+    Return the bitmask of the given ortholog databases.
+    """
+    mask = 0
+    for db in ortholog_dbs:
+        if db in SUPPORT_DBS:
+            mask |= 1 << SUPPORT_DBS.index(db)
+    return mask
+
+
 def compare(ortholog_dbs):
     hgnc = get_hgnc_mappings(ortholog_dbs)
     hgnc.rename(columns={"human_entrez_gene": "human_entrez_gene_hgnc"}, inplace=True)
@@ -235,12 +477,12 @@ def compare(ortholog_dbs):
 
 
 def get_ortholog_list():
+    mappings = get_ortholog_db_mappings()
+    species = mappings.groupby("db")["ortholog_species"].unique()
+
     data = []
-    dbs = list(get_ortholog_dbs())
-    
-    for db in dbs:
-        mappings = get_ortholog_mappings([db])
-        organisms = list(mappings["ortholog_species"].unique())
+    for db in get_ortholog_dbs():
+        organisms = list(species.get(db, []))
         organisms = sorted(organisms, key=lambda x: int(x))
         data.append({"db": db, "ortholog_species": organisms})
 
@@ -248,21 +490,42 @@ def get_ortholog_list():
 
 
 def get_ortholog_statistics():
-    data = []
-    dbs = list(get_ortholog_dbs())
-    
-    for db in dbs:
-        mappings = get_ortholog_mappings([db])
-        mappings["db"] = db
-        ortho_groups = mappings.groupby(["ortholog_species", "db"]).agg({"human_entrez_gene": "nunique", "ortholog_species_entrez_gene": "nunique"}).reset_index()
-        ortho_groups.rename(columns={"human_entrez_gene": "human_genes",  "ortholog_species_entrez_gene": "orthologs"}, inplace=True)
-        ortho_groups["orthologs_per_human_gene"] = ortho_groups["orthologs"]/ortho_groups["human_genes"]
-        data.append(ortho_groups)
-
-    statistics = pd.concat(data)
+    mappings = get_ortholog_db_mappings()
+    statistics = mappings.groupby(["ortholog_species", "db"]).agg({"human_entrez_gene": "nunique", "ortholog_species_entrez_gene": "nunique"}).reset_index()
+    statistics.rename(columns={"human_entrez_gene": "human_genes",  "ortholog_species_entrez_gene": "orthologs"}, inplace=True)
+    statistics["orthologs_per_human_gene"] = statistics["orthologs"]/statistics["human_genes"]
     statistics.sort_values(["ortholog_species", "orthologs_per_human_gene"], inplace=True)
 
     return statistics
+
+
+def get_ortholog_db_mappings():
+    """
+    Return the mappings of all ortholog databases in one table with a "db" column.
+
+    The HCOP mappings are loaded once and split by a bitwise test of their "support" bitmask.
+    """
+    hgnc = load_ortholog_store("hcop")
+    data = []
+    for db in sorted(get_ortholog_dbs() - {"JAX"}):
+        mappings = hgnc[(hgnc["support"] & support_mask([db])) != 0].drop(columns="support")
+        data.append(mappings.assign(db=db))
+
+    jax = get_jax_mappings()
+    jax["db"] = "JAX"
+    data.append(jax)
+
+    mappings = pd.concat(data, ignore_index=True)
+    mappings.drop_duplicates(inplace=True)
+
+    return mappings[["ortholog_species", "ortholog_species_entrez_gene", "human_entrez_gene", "db"]]
     
 
-    
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the local ortholog mapping store.")
+    parser.add_argument("command", choices=["refresh"], help="refresh: download the sources and build a new store version")
+    parser.add_argument("--store-path", default=None, help="store directory (default: ORTHOLOG_STORE_PATH or ../data/orthologs)")
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        refresh_ortholog_store(args.store_path)
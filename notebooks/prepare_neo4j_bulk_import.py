@@ -0,0 +1,189 @@
+"""
+This module uses metadata to prepare CSV files for the Neo4j bulk data import.
+It writes the same files as the PrepareNeo4jBulkImport notebook (header files,
+MetaNode and MetaRelationship files, args.txt, and indices.cypher) without
+starting a Jupyter kernel.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from os import walk
+
+import pandas as pd
+
+from utils import create_node_headers, create_relationship_headers, get_node_data_headers, get_relationship_data_headers, create_meta_node, create_meta_relationship
+
+
+def prepare_bulk_import(neo4j_import=None, metadata=None, data=None, max_workers=8):
+    """
+    Prepare the Neo4j import directory for a bulk import with neo4j-admin.
+
+    The node and relationship files are processed concurrently. Only the header
+    lines of the data files are read.
+
+    Parameters
+    ----------
+    neo4j_import (str): Neo4j import directory. Defaults to the "import" directory in NEO4J_HOME.
+    metadata (str): Metadata directory with "nodes" and "relationships" subdirectories.
+        Defaults to the NEO4J_METADATA environment variable.
+    data (str): Data directory with "nodes" and "relationships" subdirectories.
+        Defaults to the NEO4J_DATA environment variable.
+    max_workers (int): Number of threads used to read the metadata and data file headers.
+
+    Returns
+    -------
+    str: The arguments for neo4j-admin that were written to args.txt.
+    """
+    # If NEO4J_HOME directory is not set, use the example_results/import directory as a proxy for a Neo4j import directory.
+    if neo4j_import is None:
+        NEO4J_HOME = os.getenv("NEO4J_HOME", default="../example_results")
+        neo4j_import = os.path.join(NEO4J_HOME, "import")
+        if NEO4J_HOME == "../example_results":
+            os.makedirs(neo4j_import, exist_ok=True)
+
+    metadata = metadata or os.getenv("NEO4J_METADATA", default="../example_metadata/")
+    data = data or os.getenv("NEO4J_DATA", default="../example_data/")
+
+    # Run the node and relationship passes concurrently, they share a pool for reading the file headers
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, ThreadPoolExecutor(max_workers=2) as passes:
+        node_pass = passes.submit(prepare_nodes, neo4j_import, metadata, data, executor)
+        relationship_pass = passes.submit(prepare_relationships, neo4j_import, metadata, data, executor)
+        matched_nodes = node_pass.result()
+        matched_relationships = relationship_pass.result()
+
+    # Create Neo4j bulk upload command line arguments
+    # See: https://neo4j.com/docs/operations-manual/current/tools/neo4j-admin/neo4j-admin-import/
+    args = ""
+    for node in matched_nodes["node"].unique():
+        args += f" --nodes={node}=header_{node}_n.csv,{node}.*_n.csv.*"
+    args += " --nodes=MetaNode=MetaNode_n.csv"
+
+    rel_data = matched_relationships[["relationship", "fullRelationship"]].drop_duplicates()
+    for relationship, fullRelationship in rel_data.itertuples(index=False):
+        args += f" --relationships={relationship}=header_{fullRelationship}_r.csv,{fullRelationship}.*_r.csv.*"
+    args += " --relationships=MetaRelationship=MetaRelationship_r.csv"
+
+    with open(os.path.join(neo4j_import, "args.txt"), "w") as f:
+        f.write(args)
+
+    # Create a Cypher script with constraints for all node ids and indices and a fulltext index for all string properties
+    indices = "".join(matched_nodes["index"].unique())
+    node_names = "|".join(dict.fromkeys(matched_nodes["node"]))
+    property_names = ",n.".join(sorted({prop for props in matched_nodes["stringProperties"] for prop in props}))
+    indices += f"CREATE FULLTEXT INDEX fulltext FOR (n:{node_names}) ON EACH [n.{property_names}];"
+    indices = indices.replace(";", ";\n")
+
+    with open(os.path.join(neo4j_import, "indices.cypher"), "w") as f:
+        f.write(indices)
+
+    return args
+
+
+def prepare_nodes(neo4j_import, metadata, data, executor):
+    """
+    Match the node data files with their metadata and write the node header files and MetaNode_n.csv.
+
+    Returns
+    -------
+    pandas.DataFrame: The matched nodes with their import headers and indices.
+    """
+    # Create headers from metadata files
+    dirpath, _, filenames = next(walk(os.path.join(metadata, "nodes")))
+    node_metadata = pd.DataFrame(list(executor.map(lambda filename: create_node_headers(dirpath, filename), filenames)))
+
+    # Add constraints and indices for nodes
+    node_metadata["stringProperties"] = [get_string_properties(header) for header in node_metadata["importHeader"]]
+    node_metadata["index"] = [add_index(node, props) for node, props in node_metadata[["node", "stringProperties"]].itertuples(index=False)]
+
+    # Get headers from data files
+    dirpath, _, filenames = next(walk(os.path.join(data, "nodes")))
+    csv_files = [name for name in filenames if name.endswith((".csv", ".csv.gz"))]
+    node_data = pd.DataFrame(list(executor.map(lambda filename: get_node_data_headers(dirpath, filename), csv_files)),
+                             columns=["node", "dataHeader", "dataPath"])
+
+    # Merge metadata with data
+    matched_nodes = node_data.merge(node_metadata, on="node", how="outer")
+    matched_nodes["match"] = matched_nodes["dataHeader"] == matched_nodes["metadataHeader"]
+    matched_nodes = matched_nodes.fillna("")
+
+    mismatched_nodes = matched_nodes[(matched_nodes["match"] == False) & (matched_nodes["dataPath"] != "")]
+    if mismatched_nodes.shape[0] > 0:
+        print("The following node data files do not match the metadata specification:")
+        print(mismatched_nodes[["node", "dataPath", "dataHeader", "metadataHeader"]].to_string(index=False))
+        mismatched_nodes.to_csv(os.path.join(neo4j_import, "mismatches_n.csv"), index=False)
+
+    # Write Neo4j header files for bulk import
+    matched_nodes = matched_nodes[matched_nodes["match"] == True]
+    for node, import_header in matched_nodes[["node", "importHeader"]].itertuples(index=False):
+        save_header(os.path.join(neo4j_import, f"header_{node}_n.csv"), import_header)
+
+    # Create MetaNode file with a dictionary of all node properties
+    property_dir = {prop: "" for header in matched_nodes["metadataHeader"] for prop in header.split(",")}
+    node_list = [create_meta_node(node, property_dir, filepath) for node, filepath in matched_nodes[["node", "metadataPath"]].itertuples(index=False)]
+    meta_nodes = pd.DataFrame(node_list).drop_duplicates()
+    meta_nodes.to_csv(os.path.join(neo4j_import, "MetaNode_n.csv"), index=False)
+
+    return matched_nodes
+
+
+def prepare_relationships(neo4j_import, metadata, data, executor):
+    """
+    Match the relationship data files with their metadata and write the relationship header files and MetaRelationship_r.csv.
+
+    Returns
+    -------
+    pandas.DataFrame: The matched relationships with their import headers.
+    """
+    # Create headers from metadata files
+    dirpath, _, filenames = next(walk(os.path.join(metadata, "relationships")))
+    relationship_metadata = pd.DataFrame(list(executor.map(lambda filename: create_relationship_headers(dirpath, filename), filenames)))
+
+    # Get headers from data files
+    dirpath, _, filenames = next(walk(os.path.join(data, "relationships")))
+    csv_files = [name for name in filenames if name.endswith((".csv", ".csv.gz"))]
+    relationship_data = pd.DataFrame(list(executor.map(lambda filename: get_relationship_data_headers(dirpath, filename), csv_files)),
+                                     columns=["relationship", "dataHeader", "dataPath"])
+
+    # Merge metadata with data
+    matched_relationships = relationship_data.merge(relationship_metadata, on="relationship", how="outer")
+    matched_relationships["match"] = matched_relationships["dataHeader"] == matched_relationships["metadataHeader"]
+    matched_relationships = matched_relationships.fillna("")
+    matched_relationships["fullRelationship"] = matched_relationships["source"] + "-" + matched_relationships["relationship"] + "-" + matched_relationships["target"]
+
+    mismatched_relationships = matched_relationships[(matched_relationships["match"] == False) & (matched_relationships["dataPath"] != "")]
+    if mismatched_relationships.shape[0] > 0:
+        print("The following relationship data files do not match the metadata specification:")
+        print(mismatched_relationships[["relationship", "dataPath", "dataHeader", "metadataHeader"]].to_string(index=False))
+        mismatched_relationships.to_csv(os.path.join(neo4j_import, "mismatches_r.csv"), index=False)
+
+    # Write Neo4j header files for bulk import
+    matched_relationships = matched_relationships[matched_relationships["match"] == True]
+    for name, import_header in matched_relationships[["fullRelationship", "importHeader"]].itertuples(index=False):
+        save_header(os.path.join(neo4j_import, f"header_{name}_r.csv"), import_header)
+
+    # Create MetaRelationship file with a dictionary of all relationship properties
+    property_dir = {prop: "" for header in matched_relationships["metadataHeader"] for prop in header.split(",")}
+    relationship_list = [
+        create_meta_relationship(relationship, source, target, property_dir, filepath)
+        for relationship, source, target, filepath in matched_relationships[["relationship", "source", "target", "metadataPath"]].itertuples(index=False)
+    ]
+    meta_relationships = pd.DataFrame(relationship_list).drop_duplicates()
+    meta_relationships.to_csv(os.path.join(neo4j_import, "MetaRelationship_r.csv"), index=False)
+
+    return matched_relationships
+
+
+def get_string_properties(import_header):
+    fields = import_header.split(",")
+    return [field.split(":")[0] for field in fields if field.endswith(":string")]
+
+
+def add_index(node, properties):
+    indices = f"CREATE CONSTRAINT {node} FOR (n:{node}) REQUIRE n.id IS UNIQUE;"
+    for prop in properties:
+        indices += f"CREATE INDEX {node}_{prop} FOR (n:{node}) ON (n.{prop});"
+    return indices
+
+
+def save_header(path, import_header):
+    pd.DataFrame([], columns=import_header.split(",")).to_csv(path, index=False)
@@ -0,0 +1,100 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+import genelab_utils as gl
+
+
+class FileStub(BaseHTTPRequestHandler):
+    """
+    Local stand-in for the OSDR file download endpoint. Serves `server.content` for any path.
+    """
+
+    def do_GET(self):
+        content = self.server.content
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def file_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FileStub)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def methylation_filter(df, threshold=0.05):
+    # Same filter as in 1_download_datasets.ipynb
+    filtered_df = df[df["ENTREZID"].notna() & (df["ENTREZID"].astype(str) != "")]
+    filtered_df = filtered_df.filter(regex=r"^(ENTREZID|GENENAME|chr|start|end|dist.to.feature|prom|exon|intron|meth.diff_|qvalue_)")
+    qval_cols = [col for col in filtered_df.columns if col.startswith("qvalue_")]
+    filtered_df = filtered_df[filtered_df[qval_cols].le(threshold).any(axis=1)]
+    if "ENTREZID" in filtered_df.columns:
+        filtered_df["ENTREZID"] = filtered_df["ENTREZID"].astype(str)
+        filtered_df["ENTREZID"] = filtered_df["ENTREZID"].apply(lambda x: x.split("|"))
+        filtered_df = filtered_df.explode("ENTREZID")
+        filtered_df["ENTREZID"] = filtered_df["ENTREZID"].str.strip()
+    return filtered_df
+
+
+def methylation_csv():
+    # Numeric chromosomes and genes in the first chunks, text and missing values in later chunks only
+    rows = []
+    for i in range(12):
+        chromosome = "X" if i == 10 else str(i // 4 + 1)
+        entrez = "" if i == 5 else ("101|102" if i == 9 else str(100 + i))
+        qvalue = "" if i == 7 else ("0.5" if i % 3 == 2 else "0.01")
+        rows.append(
+            f"{entrez},Gene{i},{chromosome},{1000 * i + 1},{1000 * (i + 1)},{-500 + i},{i % 2},{(i + 1) % 2},0,{2.5 * i},{qvalue}"
+        )
+    header = "ENTREZID,GENENAME,chr,start,end,dist.to.feature,prom,exon,intron,meth.diff_A,qvalue_A"
+    return ("\n".join([header] + rows) + "\n").encode()
+
+
+def test_streamed_parquet_matches_whole_file(file_server, tmp_path):
+    file_server.content = methylation_csv()
+    url = f"http://127.0.0.1:{file_server.server_port}/meth.csv"
+    filename = "GLDS-1_methylation_differential_methylation_tiles.csv"
+    whole_path = str(tmp_path / "whole")
+    streamed_path = str(tmp_path / "streamed")
+    os.makedirs(whole_path)
+    os.makedirs(streamed_path)
+
+    assert gl._download_data_file(url, filename, methylation_filter, whole_path, file_format="parquet")[0]
+    assert gl._download_data_file(url, filename, methylation_filter, streamed_path, chunksize=4, file_format="parquet")[0]
+
+    whole = pd.read_parquet(gl.find_dataset_file(whole_path, filename))
+    streamed = pd.read_parquet(gl.find_dataset_file(streamed_path, filename))
+    pd.testing.assert_frame_equal(streamed, whole)
+    assert streamed["start"].dtype == "int64"
+    assert pq.read_schema(gl.find_dataset_file(streamed_path, filename)).equals(
+        pq.read_schema(gl.find_dataset_file(whole_path, filename))
+    )
+    whole_header = gl.get_dataset_header(whole_path, filename)
+    streamed_header = gl.get_dataset_header(streamed_path, filename)
+    for key in ["columns", "dtypes", "rows"]:
+        assert streamed_header[key] == whole_header[key]
+
+    results = []
+    for dataset_path in [whole_path, streamed_path]:
+        columns = gl.get_dataset_columns(dataset_path, filename)
+        results.append(gl._extract_methylation_file(dataset_path, filename, columns, ["OSD-1"], ["A"], ["OSD-1-a"], 0.05))
+    whole_regions, streamed_regions = results
+    assert list(streamed_regions["methylation_id"]) == list(whole_regions["methylation_id"])
+    assert list(streamed_regions["methylation_id"])[:2] == ["1:1-1000", "1:1001-2000"]
+    assert "X:10001-11000" in set(streamed_regions["methylation_id"])
+    assert list(streamed_regions["start"].astype(str)) == list(whole_regions["start"].astype(str))
+    assert list(streamed_regions["end"].astype(str)) == list(whole_regions["end"].astype(str))
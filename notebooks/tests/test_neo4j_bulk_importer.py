@@ -0,0 +1,134 @@
+import sys
+import types
+
+import pytest
+
+import neo4j_bulk_importer as importer
+
+
+class FakeCursor:
+    def __init__(self, records):
+        self.records = records
+        self.consumed = False
+
+    def stats(self):
+        self.consumed = True
+        return {}
+
+    def data(self):
+        self.consumed = True
+        return self.records
+
+    def evaluate(self):
+        self.consumed = True
+        return next(iter(self.records[0].values())) if self.records else None
+
+
+class FakeGraph:
+    """
+    Stand-in for py2neo.Graph that records the connections and statements.
+    Results of statements are looked up by prefix in `responses`: a list of
+    results (lists of records) that are returned in turn, repeating the last one.
+    """
+
+    instances = []
+    responses = {}
+
+    def __init__(self, profile=None, name=None, **settings):
+        self.profile = profile
+        self.name = name
+        self.settings = settings
+        self.statements = []
+        self.cursors = []
+        FakeGraph.instances.append(self)
+
+    def run(self, cypher, parameters=None, **kwparameters):
+        self.statements.append((cypher, {**(parameters or {}), **kwparameters}))
+        records = []
+        for prefix, response in FakeGraph.responses.items():
+            if cypher.startswith(prefix):
+                records = response.pop(0) if len(response) > 1 else response[0]
+                break
+        cursor = FakeCursor(records)
+        self.cursors.append(cursor)
+        return cursor
+
+
+@pytest.fixture
+def graphs(monkeypatch, tmp_path):
+    FakeGraph.instances = []
+    FakeGraph.responses = {}
+    monkeypatch.setitem(sys.modules, "py2neo", types.SimpleNamespace(Graph=FakeGraph))
+    monkeypatch.setattr(importer, "_graphs", {})
+    monkeypatch.setattr(importer.time, "sleep", lambda seconds: None)
+
+    import_dir = tmp_path / "import"
+    import_dir.mkdir()
+    monkeypatch.setenv("NEO4J_CYPHER_BACKEND", "bolt")
+    monkeypatch.setenv("NEO4J_URI", "bolt://localhost:7687")
+    monkeypatch.setenv("NEO4J_USERNAME", "neo4j")
+    monkeypatch.setenv("NEO4J_PASSWORD", "secret")
+    monkeypatch.setenv("NEO4J_DATABASE", "spoke-genelab")
+    monkeypatch.setenv("NEO4J_HOME", str(tmp_path))
+    return FakeGraph
+
+
+def test_create_database_waits_until_online(graphs):
+    graphs.responses["SHOW DATABASE"] = [[{"currentStatus": "offline"}], [{"currentStatus": "starting"}], [{"currentStatus": "online"}]]
+
+    importer.create_database()
+
+    (system,) = graphs.instances
+    assert system.name == "system"
+    assert system.profile == "bolt://localhost:7687"
+    assert system.settings == {"user": "neo4j", "password": "secret"}
+    statements = [cypher for cypher, _ in system.statements]
+    assert statements[0] == "CREATE OR REPLACE DATABASE `spoke-genelab`"
+    assert statements[1:] == ["SHOW DATABASE $name YIELD currentStatus"] * 3
+    assert all(params == {"name": "spoke-genelab"} for _, params in system.statements[1:])
+
+
+def test_wait_for_database_times_out(graphs):
+    graphs.responses["SHOW DATABASE"] = [[{"currentStatus": "offline"}]]
+
+    with pytest.raises(TimeoutError):
+        importer.wait_for_database("spoke-genelab", timeout=0)
+
+
+def test_add_indices_runs_statements_and_waits_for_indexes(graphs, tmp_path):
+    (tmp_path / "import" / "indices.cypher").write_text(
+        "CREATE CONSTRAINT Study FOR (n:Study) REQUIRE n.id IS UNIQUE;\n"
+        "CREATE INDEX Study_name FOR (n:Study) ON (n.name);\n"
+    )
+
+    importer.add_indices()
+
+    (graph,) = graphs.instances
+    assert graph.name == "spoke-genelab"
+    assert [cypher for cypher, _ in graph.statements] == [
+        "CREATE CONSTRAINT Study FOR (n:Study) REQUIRE n.id IS UNIQUE",
+        "CREATE INDEX Study_name FOR (n:Study) ON (n.name)",
+        f"CALL db.awaitIndexes({importer.INDEX_TIMEOUT})",
+    ]
+    # Each statement is run to completion before the next one
+    assert all(cursor.consumed for cursor in graph.cursors)
+
+
+def test_connections_are_reused(graphs, tmp_path):
+    graphs.responses["SHOW DATABASE"] = [[{"currentStatus": "online"}]]
+    (tmp_path / "import" / "indices.cypher").write_text("CREATE INDEX Study_name FOR (n:Study) ON (n.name);\n")
+
+    importer.drop_database()
+    importer.create_database()
+    importer.add_indices()
+    importer.execute_cypher(["MATCH (n) RETURN count(n)"], "spoke-genelab")
+
+    # One connection per database for all statements
+    assert sorted(graph.name for graph in graphs.instances) == ["spoke-genelab", "system"]
+    assert set(importer._graphs) == {"spoke-genelab", "system"}
+    system = importer._graphs["system"]
+    assert [cypher for cypher, _ in system.statements][:2] == [
+        "DROP DATABASE `spoke-genelab` IF EXISTS",
+        "CREATE OR REPLACE DATABASE `spoke-genelab`",
+    ]
+    assert len(importer._graphs["spoke-genelab"].statements) == 3
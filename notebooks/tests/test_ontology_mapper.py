@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import ontology_mapper
+
+
+class RecommenderStub(BaseHTTPRequestHandler):
+    """
+    Local stand-in for the BioPortal recommender. Every term, except terms starting
+    with "unmapped", is annotated with a class whose id is derived from the term.
+    The first `fail` requests are answered with 429 Too Many Requests.
+    """
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests.append((time.monotonic(), body))
+            fail = server.fail > 0
+            server.fail -= 1
+
+        if fail:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        annotations = [
+            {"text": term.upper(), "annotatedClass": {"@id": f"http://purl.obolibrary.org/obo/UBERON_{term.replace(' ', '_')}"}}
+            for term in body["input"].split(",")
+            if not term.startswith("unmapped")
+        ]
+        content = json.dumps([{"coverageResult": {"annotations": annotations}}]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def recommender(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RecommenderStub)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.fail = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(ontology_mapper, "RECOMMENDER_URL", f"http://127.0.0.1:{server.server_port}/recommender")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_lookup_terms_batches_requests(recommender, tmp_path):
+    terms = [f"term {i}" for i in range(120)]
+    cache = ontology_mapper.TermCache(str(tmp_path / "cache.json"))
+
+    results = ontology_mapper.lookup_terms(terms, "UBERON", "key", cache, max_workers=3, rate_limit=100)
+
+    batches = [body["input"].split(",") for _, body in recommender.requests]
+    assert sorted(len(batch) for batch in batches) == [20, 50, 50]
+    assert sorted(term for batch in batches for term in batch) == sorted(terms)
+    assert all(body["ontologies"] == "UBERON" for _, body in recommender.requests)
+    assert results["term 7"] == [["http://purl.obolibrary.org/obo/UBERON_term_7", "term 7"]]
+
+
+def test_lookup_terms_retries_rate_limited_requests(recommender):
+    recommender.fail = 1
+
+    results = ontology_mapper.lookup_terms(["liver", "brain"], "UBERON", "key", max_workers=1, rate_limit=100)
+
+    # The 429 response is retried by the session
+    assert len(recommender.requests) == 2
+    assert results["liver"] == [["http://purl.obolibrary.org/obo/UBERON_liver", "liver"]]
+
+
+def test_lookup_terms_respects_rate_limit(recommender, monkeypatch):
+    monkeypatch.setattr(ontology_mapper, "CHUNK_SIZE", 1)
+    rate_limit = 10
+
+    ontology_mapper.lookup_terms([f"term {i}" for i in range(5)], "UBERON", "key", max_workers=5, rate_limit=rate_limit)
+
+    times = sorted(t for t, _ in recommender.requests)
+    assert len(times) == 5
+    # 5 requests with a burst of 1 take at least 4 intervals
+    assert times[-1] - times[0] >= 4 / rate_limit * 0.9
+
+
+def test_second_run_is_served_from_term_cache(recommender, tmp_path):
+    path = str(tmp_path / "cache.json")
+    terms = ["liver", "brain", "unmapped"]
+    first = ontology_mapper.lookup_terms(terms, "UBERON", "key", ontology_mapper.TermCache(path), rate_limit=100)
+    n_requests = len(recommender.requests)
+    assert n_requests == 1
+
+    # A new cache instance reads the saved results from disk
+    second = ontology_mapper.lookup_terms(terms, "UBERON", "key", ontology_mapper.TermCache(path), rate_limit=100)
+
+    assert len(recommender.requests) == n_requests
+    assert second == first
+    assert second["unmapped"] == []
@@ -76,9 +76,10 @@ def get_node_data_headers(dirname, filename):
     # get node name
     node = re.split('\.|_', filename)[0]
     
-    # read metadata file
+    # read header of data file. Data files without a header line have a separate header file.
     data_path = os.path.join(dirname, filename)
-    df = pd.read_csv(data_path, nrows=0)
+    header_path = data_path + '.header'
+    df = pd.read_csv(header_path if os.path.exists(header_path) else data_path, nrows=0)
     
     # create csv header
     columns = list(df.columns)
@@ -98,9 +99,10 @@ def get_relationship_data_headers(dirname, filename):
     parts = filename.split('-', 2)
     relationship = parts[1]
     
-    # read metadata file
+    # read header of data file. Data files without a header line have a separate header file.
     data_path = os.path.join(dirname, filename)
-    df = pd.read_csv(data_path, nrows=0)
+    header_path = data_path + '.header'
+    df = pd.read_csv(header_path if os.path.exists(header_path) else data_path, nrows=0)
     
     # create csv header
     columns = list(df.columns)